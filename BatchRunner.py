@@ -0,0 +1,288 @@
+import argparse
+import csv
+import os
+from multiprocessing import Process, Queue, Value
+from queue import Empty
+
+from DelayModel import DelayModel, read_delay_causes
+from InstanceStore import read_locs
+from MapLoader import load_map
+from PlannerStats import STATS_COLUMNS, stats_row
+from RunAlgorithmTest import run_Test
+
+columns = ["Algorithm", "Map", "Desired Safe prob", "Delay prob (Planning)", "Delay prob (Execution)",
+           "Number of agents", "Number of goals", "Instance", "Runtime", "Offline Runtime", "Online Runtime",
+           "Number Of Replans", "Online Sum of Service Time", "Offline Sum of Service Time", "Number of Expands",
+           "Min Safe Prob"] + list(STATS_COLUMNS.values())
+
+# Columns that identify a job, used to skip jobs that are already written when resuming a sweep
+key_columns = ["Algorithm", "Map", "Desired Safe prob", "Delay prob (Execution)", "Number of agents",
+               "Number of goals", "Instance"]
+
+# Seconds between two checks that every worker is still alive while waiting for results
+worker_poll_interval = 5
+
+
+####################################################### Gurobi model per job ######################################################################
+def create_gurobi_model():
+    import gurobipy as gp
+
+    env = gp.Env(empty=True)
+    env.setParam("OutputFlag", 0)
+    env.start()
+
+    model = gp.Model("MinimizeTotalServiceTime", env=env)
+    model.setParam("OutputFlag", 0)
+    model.setParam("TimeLimit", 20)
+    model.setParam("IntFeasTol", 1e-9)
+    model.setParam("Seed", 42)
+    return env, model
+
+
+####################################################### Build jobs #################################################################################
+def safe_probs_for_algorithm(algorithm):
+    if algorithm == "Baselines":
+        return ["NotAvailable", 0]
+    return [0.05, 0.25, 0.5, 0.8, 0.95, 0.99, 0.999, 0.9999]
+
+
+def build_jobs(algorithms, maps, agents, goals, delays, instances, delayCauses=(None, None)):
+    jobs = []
+    for algorithm in algorithms:
+        for map_name in maps:
+            for num_of_agents in agents:
+                for num_of_goals in goals:
+                    for delay_prob_Exec in delays:
+                        for instance in range(1, instances + 1):
+                            for desired_safe_prob in safe_probs_for_algorithm(algorithm):
+                                jobs.append({"Algorithm": algorithm, "Map": map_name, "Agents": num_of_agents,
+                                             "Goals": num_of_goals, "DelayExec": delay_prob_Exec,
+                                             "Instance": instance, "SafeProb": desired_safe_prob,
+                                             "DelayCauses": delayCauses})
+    return jobs
+
+
+def job_key(algorithm, map_name, safe_prob, delay_prob_Exec, num_of_agents, num_of_goals, instance):
+    return tuple(str(value) for value in
+                 (algorithm, map_name, safe_prob, delay_prob_Exec, num_of_agents, num_of_goals, instance))
+
+
+def read_completed_jobs(output_file):
+    completed = set()
+    if not os.path.exists(output_file):
+        return completed
+
+    upgrade_header(output_file)
+    with open(output_file, mode="r", newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            completed.add(tuple(row[column] for column in key_columns))
+    return completed
+
+
+def upgrade_header(output_file):
+    # A file written with an older set of columns (e.g. before the planner stats) is rewritten with the current
+    # header, its rows leaving the new cells empty, so that the rows appended now line up with the header
+    with open(output_file, mode="r", newline="", encoding="utf-8") as file:
+        reader = csv.DictReader(file)
+        header = reader.fieldnames or []
+        if header == columns:
+            return
+        unknown = [column for column in header if column not in columns]
+        if unknown:
+            raise ValueError(f"{output_file} has columns {unknown} that this runner does not write; "
+                             f"use --no-resume or another --output")
+        rows = list(reader)
+
+    temp_file = output_file + ".tmp"
+    with open(temp_file, mode="w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=columns, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(temp_file, output_file)
+    print(f"{output_file}: header updated to the current columns, new cells of its {len(rows)} rows left empty",
+          flush=True)
+
+
+####################################################### run Job  #################################################################################
+def run_job(job, mapAndDim, gurobiModel):
+    algorithm = "Strict" if job["Algorithm"] == "Baselines" else job["Algorithm"]
+    desired_safe_prob = job["SafeProb"]
+    cellDelays, timeDelays = job["DelayCauses"]
+    if desired_safe_prob != "NotAvailable":
+        DelaysProbDictPlanning = DelayModel({i: job["DelayExec"] for i in range(job["Agents"])}, cellDelays, timeDelays)
+    else:
+        DelaysProbDictPlanning = {i: 0 for i in range(job["Agents"])}
+    DelaysProbDictExecution = DelayModel({i: job["DelayExec"] for i in range(job["Agents"])}, cellDelays, timeDelays)
+    AgentLocations, GoalLocations = read_locs(job["Map"], job["Instance"], job["Agents"], job["Goals"])
+    profile_name = f"{job['Algorithm']}_{job['Map']}_num_of_agents_{job['Agents']}_num_of_goals_{job['Goals']}_" \
+                   f"delay_prob_Exec_{job['DelayExec']}"
+
+    return run_Test(desired_safe_prob, AgentLocations, GoalLocations, DelaysProbDictPlanning, DelaysProbDictExecution,
+                    job["Instance"], mapAndDim, gurobiModel, algorithm, profile_name)
+
+
+def job_record(job, result):
+    offlineRuntime, onlineRuntime, numOfReplans, sstOnline, sstOffline, CountExpand, MinSafeProb, stats = result
+    delay_prob_plan = job["DelayExec"] if job["SafeProb"] != "NotAvailable" else 0
+    runtime = round(offlineRuntime + onlineRuntime, 3) if onlineRuntime is not None else None
+
+    return [job["Algorithm"], job["Map"], job["SafeProb"], delay_prob_plan, job["DelayExec"], job["Agents"],
+            job["Goals"], job["Instance"], runtime, offlineRuntime, onlineRuntime, numOfReplans, sstOnline,
+            sstOffline, CountExpand, MinSafeProb] + stats_row(stats)
+
+
+####################################################### Worker #################################################################################
+def worker(job_queue, result_queue, current):
+    maps = {}
+
+    while True:
+        item = job_queue.get()
+        if item is None:
+            break
+        index, job = item
+        # Lets run_jobs tell which job was lost if this process dies; a shared value is written at once, where a
+        # message still in the queue's buffer would die with the process
+        current.value = index
+
+        env, gurobiModel = None, None
+        try:
+            if job["Map"] not in maps:
+                maps[job["Map"]] = load_map(job["Map"])
+
+            # Each job owns its Gurobi environment so jobs never share solver state
+            env, gurobiModel = create_gurobi_model()
+            record = job_record(job, run_job(job, maps[job["Map"]], gurobiModel))
+        except Exception as e:
+            # The job is left out of the CSV so that resuming the sweep runs it again
+            print(f"Job {job} failed: {e!r}", flush=True)
+            record = None
+        finally:
+            if gurobiModel is not None:
+                gurobiModel.dispose()
+            if env is not None:
+                env.dispose()
+
+        result_queue.put((index, record))
+
+
+####################################################### run Jobs #################################################################################
+def start_worker(job_queue, result_queue):
+    # Workers are regular (non-daemonic) processes since every job forks its own planner process
+    current = Value("l", -1, lock=False)
+    p = Process(target=worker, args=(job_queue, result_queue, current))
+    p.start()
+    return p, current
+
+
+def run_jobs(jobs, output_file, num_workers):
+    if not os.path.exists(output_file):
+        with open(output_file, mode="w", newline="", encoding="utf-8") as file:
+            writer = csv.DictWriter(file, fieldnames=columns)
+            writer.writeheader()
+    with open(output_file, mode="r", newline="", encoding="utf-8") as file:
+        rows_before = sum(1 for _ in csv.reader(file)) - 1
+
+    job_queue, result_queue = Queue(), Queue()
+    for index, job in enumerate(jobs):
+        job_queue.put((index, job))
+
+    num_workers = max(1, min(num_workers, len(jobs)))
+    for _ in range(num_workers):
+        job_queue.put(None)
+
+    # Each worker with the index of the job it runs (or ran last)
+    workers = [start_worker(job_queue, result_queue) for _ in range(num_workers)]
+
+    # Jobs done or lost
+    finished = set()
+    while len(finished) < len(jobs):
+        try:
+            index, record = result_queue.get(timeout=worker_poll_interval)
+        except Empty:
+            # A worker that died (out of memory, a crash in the solver) never reports its job; the job is left out
+            # of the CSV so that resuming the sweep runs it again, and a new worker takes the dead one's place
+            for i, (p, current) in enumerate(workers):
+                if not p.is_alive() and p.exitcode != 0:
+                    if current.value >= 0 and current.value not in finished:
+                        print(f"Job {jobs[current.value]} lost: worker exited with code {p.exitcode}", flush=True)
+                        finished.add(current.value)
+                    workers[i] = start_worker(job_queue, result_queue)
+            # Every worker has taken its end marker, so no result is still to come
+            if not any(p.is_alive() for p, _ in workers):
+                print(f"{len(jobs) - len(finished)} jobs lost with no worker left to report them", flush=True)
+                break
+            continue
+
+        if index in finished:
+            continue
+        finished.add(index)
+        # Rows are appended as they arrive, so a crash of the sweep loses no finished job
+        if record is not None:
+            with open(output_file, mode="a", newline="", encoding="utf-8") as file:
+                csv.writer(file).writerow(record)
+        print(f"{len(finished)}/{len(jobs)} jobs done, written to {output_file}", flush=True)
+
+    for p, _ in workers:
+        p.join()
+
+    sort_new_rows(output_file, jobs, rows_before)
+
+
+def sort_new_rows(output_file, jobs, rows_before):
+    # Puts the rows of this run in job order, after the rows already in the file, so the output does not depend
+    # on which worker finished first
+    order = {job_key(job["Algorithm"], job["Map"], job["SafeProb"], job["DelayExec"], job["Agents"], job["Goals"],
+                     job["Instance"]): index for index, job in enumerate(jobs)}
+    keyIndexes = [columns.index(column) for column in key_columns]
+
+    with open(output_file, mode="r", newline="", encoding="utf-8") as file:
+        rows = list(csv.reader(file))
+    header, old_rows, new_rows = rows[0], rows[1:1 + rows_before], rows[1 + rows_before:]
+    new_rows.sort(key=lambda row: order.get(tuple(row[i] for i in keyIndexes), len(jobs)))
+
+    temp_file = output_file + ".tmp"
+    with open(temp_file, mode="w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(old_rows + new_rows)
+    os.replace(temp_file, output_file)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the robust planner over a grid of experiment configurations.")
+    parser.add_argument("--algorithms", nargs="+", default=["Strict", "Anytime", "Baselines"])
+    parser.add_argument("--maps", nargs="+", required=True)
+    parser.add_argument("--agents", nargs="+", type=int, required=True)
+    parser.add_argument("--goals", nargs="+", type=int, required=True)
+    parser.add_argument("--delays", nargs="+", type=float, required=True)
+    parser.add_argument("--instances", type=int, default=75)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default="Output_files/Output_Batch.csv")
+    parser.add_argument("--delay-model", default=None,
+                        help="JSON file of cell and time delays applied on top of --delays (see DelayModel.py); "
+                             "not part of the CSV, so keep one file per output")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="overwrite the output file instead of skipping jobs it already contains")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    if args.no_resume and os.path.exists(args.output):
+        os.remove(args.output)
+
+    delayCauses = read_delay_causes(args.delay_model) if args.delay_model else (None, None)
+    all_jobs = build_jobs(args.algorithms, args.maps, args.agents, args.goals, args.delays, args.instances,
+                          delayCauses)
+    completed = read_completed_jobs(args.output)
+    remaining_jobs = [job for job in all_jobs
+                      if job_key(job["Algorithm"], job["Map"], job["SafeProb"], job["DelayExec"], job["Agents"],
+                                 job["Goals"], job["Instance"]) not in completed]
+
+    print(f"{len(all_jobs)} jobs in sweep, {len(all_jobs) - len(remaining_jobs)} already completed", flush=True)
+    if remaining_jobs:
+        run_jobs(remaining_jobs, args.output, args.workers)
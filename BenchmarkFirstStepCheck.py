@@ -0,0 +1,62 @@
+import sys
+import timeit
+
+from FindConflict import FindConflict
+from NodeStateClasses import Node
+from Run_Simulation import Run_Simulation
+
+
+####################################################### Reference (list scan) #################################################################################
+def list_scan_first_step_check(N):
+    # The previous implementation, kept here only to compare against
+    potential_locs = []
+
+    for currAgent, path in N.paths.items():
+        currLoc = path["path"][0]
+        for agent, loc, time in potential_locs:
+            if currLoc == loc and currAgent != agent:
+                return False
+        potential_locs.append((currAgent, currLoc, 0))
+
+        if len(path["path"]) > 1:
+            nextLoc = path["path"][1]
+            for agent, loc, time in potential_locs:
+                if nextLoc == loc and currAgent != agent:
+                    return False
+            potential_locs.append((currAgent, nextLoc, 1))
+
+    return True
+
+
+####################################################### Benchmark #################################################################################
+def conflict_free_node(num_of_agents, path_length=50):
+    # Each agent moves along its own row, so no check can stop early
+    N = Node()
+    for agent in range(num_of_agents):
+        start = agent * (path_length + 1)
+        N.paths[agent] = {"path": list(range(start, start + path_length)), "cost": path_length - 1}
+    return N
+
+
+def per_call_us(func, repeat=5):
+    number, _ = timeit.Timer(func).autorange()
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def run_benchmark(agent_counts):
+    findConflict_algorithm = FindConflict({0: 0.1})
+
+    print(f"{'agents':>8} {'list scan (us)':>16} {'FindConflict (us)':>18} {'Run_Simulation (us)':>20}")
+    for num_of_agents in agent_counts:
+        N = conflict_free_node(num_of_agents)
+        simulation = Run_Simulation(N.paths, {agent: 0.1 for agent in N.paths}, [], [], None, 0, 0)
+
+        assert findConflict_algorithm.Check_Potential_Conflict_in_first_step(N) and list_scan_first_step_check(N)
+        list_scan = per_call_us(lambda: list_scan_first_step_check(N))
+        hashed = per_call_us(lambda: findConflict_algorithm.Check_Potential_Conflict_in_first_step(N))
+        occupancy = per_call_us(simulation.Check_Potential_Conflict_With_Delay)
+        print(f"{num_of_agents:>8} {list_scan:>16.1f} {hashed:>18.1f} {occupancy:>20.1f}")
+
+
+if __name__ == "__main__":
+    run_benchmark([int(arg) for arg in sys.argv[1:]] or [70, 500])
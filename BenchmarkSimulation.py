@@ -0,0 +1,70 @@
+import sys
+import time
+
+import numpy as np
+
+from NodeStateClasses import Node
+from SimulationCore import SimulationCore
+from Verify import Verify
+
+delay_prob = 0.1
+trials = 100
+
+
+####################################################### Benchmark #################################################################################
+def lane_plan(num_of_agents, path_length, shared):
+    # Agents move along lanes of a grid with path_length columns (500 x 500 cells for 500 agents of 500 steps), so
+    # no trial ends early on a collision. With shared, two agents take each lane: the second waits in a cell of its
+    # own for path_length steps, then follows the lane to its last cell but one, so every lane cell is at risk
+    N = Node()
+    lanes = (num_of_agents + 1) // 2 if shared else num_of_agents
+    for agent in range(num_of_agents):
+        lane = agent // 2 if shared else agent
+        path = list(range(lane * path_length, (lane + 1) * path_length))
+        if shared and agent % 2:
+            path = [lanes * path_length + lane] * path_length + path[:-1]
+        N.paths[agent] = {"path": path, "cost": len(path) - 1}
+    return N.paths
+
+
+def time_trials(run, num_of_trials):
+    start = time.perf_counter()
+    successes = run(num_of_trials)
+    elapsed = time.perf_counter() - start
+    assert successes == num_of_trials
+    return elapsed
+
+
+def run_benchmark(agent_counts, path_lengths, python_cap):
+    # ns per agent-timestep stays about flat as agents x timesteps grows when scaling is near linear; the Python
+    # reference (Verify.run_s_simulations) is only timed up to python_cap agent-timesteps, with fewer trials
+    print(f"{'layout':>7} {'agents':>7} {'steps':>6} {'core s/trial':>13} {'core ns/agent-step':>19} {'python s/trial':>15}")
+    for shared in (False, True):
+        for num_of_agents in agent_counts:
+            for path_length in path_lengths:
+                paths = lane_plan(num_of_agents, path_length, shared)
+                delaysProb = {agent: delay_prob for agent in paths}
+                # Trials last about the longest path / (1 - delay_prob) timesteps
+                agentSteps = num_of_agents * max(len(info["path"]) for info in paths.values()) / (1 - delay_prob)
+
+                core = SimulationCore(paths, delaysProb, np.random.default_rng(47))
+                core_time = time_trials(core.run, trials) / trials
+
+                python_time = ""
+                if agentSteps <= python_cap:
+                    verify_algorithm = Verify(delaysProb, 0.9, 0.05, None, None, "Strict")
+                    python_trials = max(1, trials // 10)
+                    python_time = time_trials(lambda s0: verify_algorithm.run_s_simulations(s0, paths),
+                                              python_trials) / python_trials
+                    python_time = f"{python_time:.4f}"
+
+                print(f"{'shared' if shared else 'lanes':>7} {num_of_agents:>7} {path_length:>6} {core_time:>13.4f} "
+                      f"{core_time / agentSteps * 1e9:>19.1f} {python_time:>15}", flush=True)
+
+
+if __name__ == "__main__":
+    # python BenchmarkSimulation.py [agents ...] [--steps steps ...]
+    args = sys.argv[1:]
+    steps = [int(arg) for arg in args[args.index("--steps") + 1:]] if "--steps" in args else [100, 500]
+    agents = [int(arg) for arg in (args[:args.index("--steps")] if "--steps" in args else args)]
+    run_benchmark(agents or [100, 500, 1000, 2000], steps, python_cap=200000)
@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+
+import numpy as np
+
+from DelayModel import DelayModel
+from FindConflict import FindConflict
+from InstanceStore import read_locs
+from LowLevelPlan import LowLevelPlan
+from MapLoader import load_map, precompute_costs
+from NodeStateClasses import Node
+from Run_Simulation import Run_Simulation
+from SimulationCore import SimulationCore
+from Verify import Verify
+
+fixtures_file = "Benchmark_fixtures/allocations.json"
+
+# (map, instance, agents, goals) of every fixture; allocations are the best SST ones the MILP finds in its time limit
+fixture_configs = [("maze-32-32-2", 1, 8, 16), ("room-32-32-4", 1, 8, 16), ("random-32-32-20", 1, 8, 16),
+                   ("warehouse-10-20-10-2-1", 1, 8, 16)]
+
+delay_prob = 0.1
+# Extra delay of the cells in the top half of the map (a congested zone), and of the first timesteps
+zone_delay_prob = 0.2
+rush_delay_probs = [0.1] * 20 + [0]
+simulations_per_call = 100
+
+
+####################################################### Fixtures #################################################################################
+def make_fixtures():
+    # Needs Gurobi; only run when the fixtures are regenerated
+    import gurobipy as gp
+    from kBestSequencingByService import kBestSequencingByService
+
+    fixtures = []
+    for map_name, instance, num_of_agents, num_of_goals in fixture_configs:
+        AgentLocations, GoalLocations = read_locs(map_name, instance, num_of_agents, num_of_goals)
+        model = gp.Model("MinimizeTotalServiceTime")
+        model.setParam("OutputFlag", 0)
+        model.setParam("TimeLimit", 120)
+        model.setParam("Seed", 42)
+        allocation = next(kBestSequencingByService(AgentLocations, GoalLocations, load_map(map_name), model))
+        model.dispose()
+
+        fixtures.append({"Map": map_name, "Instance": instance, "Agents": AgentLocations, "Goals": GoalLocations,
+                         "Allocations": [allocation["Allocations"][agent] for agent in range(num_of_agents)],
+                         "Cost": allocation["Cost"]})
+        print(f"{map_name}: allocation cost {allocation['Cost']}", flush=True)
+
+    os.makedirs(os.path.dirname(fixtures_file), exist_ok=True)
+    with open(fixtures_file, "w", encoding="utf-8") as file:
+        json.dump(fixtures, file, indent=1)
+
+
+def load_fixtures():
+    with open(fixtures_file, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def root_node(fixture, lowLevelPlanner):
+    N = Node()
+    N.sequence = {"Allocations": dict(enumerate(fixture["Allocations"])), "Cost": fixture["Cost"]}
+    lowLevelPlanner.runLowLevelPlan(N, list(range(len(fixture["Agents"]))))
+    return N
+
+
+####################################################### Benchmark #################################################################################
+def per_call_us(func, repeat):
+    number, _ = timeit.Timer(func).autorange()
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6, number
+
+
+def benchmark_fixture(fixture, repeat):
+    mapAndDim = load_map(fixture["Map"])
+    AgentLocations, GoalLocations = fixture["Agents"], fixture["Goals"]
+    cost_dict = precompute_costs(mapAndDim, GoalLocations)
+    delaysProb = {agent: delay_prob for agent in range(len(AgentLocations))}
+    noDelaysProb = {agent: 0 for agent in range(len(AgentLocations))}
+
+    # Root paths of the stored allocation, shared by the conflict and simulation benchmarks
+    N = root_node(fixture, LowLevelPlan(mapAndDim, AgentLocations, cost_dict, "SST"))
+    findConflictWithoutDelays = FindConflict(noDelaysProb)
+    findConflictWithDelays = FindConflict(delaysProb)
+    verify_algorithm = Verify(delaysProb, 0.9, 0.05, None, findConflictWithDelays, "Strict")
+    simulationCore = SimulationCore(N.paths, delaysProb, np.random.default_rng(47))
+    zonedDelays = DelayModel(delaysProb, {cell: zone_delay_prob for cell in range(mapAndDim["Rows"] * mapAndDim["Cols"] // 2)},
+                             rush_delay_probs)
+    zonedSimulationCore = SimulationCore(N.paths, zonedDelays, np.random.default_rng(47))
+
+    benchmarks = {
+        "precompute_costs": lambda: precompute_costs(mapAndDim, GoalLocations),
+        # A new planner per call, so no call profits from the caches of the previous one
+        "runLowLevelPlan": lambda: root_node(fixture, LowLevelPlan(mapAndDim, AgentLocations, cost_dict, "SST")),
+        "findConflict (no delays)": lambda: findConflictWithoutDelays.findConflict(N),
+        "findConflict (delays)": lambda: findConflictWithDelays.findConflict(N),
+        f"run_s_simulations ({simulations_per_call})":
+            lambda: verify_algorithm.run_s_simulations(simulations_per_call, N.paths),
+        f"SimulationCore.run ({simulations_per_call})": lambda: simulationCore.run(simulations_per_call),
+        f"SimulationCore.run zoned ({simulations_per_call})": lambda: zonedSimulationCore.run(simulations_per_call),
+        "runSimulation": lambda: Run_Simulation(N.paths, delaysProb, AgentLocations, GoalLocations,
+                                                random.Random(44), 0, 0).runSimulation(),
+    }
+
+    results = []
+    for name, func in benchmarks.items():
+        us, number = per_call_us(func, repeat)
+        results.append({"benchmark": name, "map": fixture["Map"], "instance": fixture["Instance"],
+                        "agents": len(AgentLocations), "goals": len(GoalLocations), "per_call_us": round(us, 1),
+                        "calls": number})
+        print(f"{fixture['Map']:>24} {name:>30} {us:>14.1f} us", file=sys.stderr, flush=True)
+    return results
+
+
+def run_benchmarks(maps, repeat):
+    results = []
+    for fixture in load_fixtures():
+        if not maps or fixture["Map"] in maps:
+            results.extend(benchmark_fixture(fixture, repeat))
+
+    return {"python": platform.python_version(), "machine": platform.machine(), "repeat": repeat,
+            "results": results}
+
+
+####################################################### Compare #################################################################################
+def compare(current, baseline_file):
+    # Ratio of each benchmark's time to the same benchmark in an earlier JSON output (above 1 is slower)
+    with open(baseline_file, "r", encoding="utf-8") as file:
+        baseline = {(r["benchmark"], r["map"]): r["per_call_us"] for r in json.load(file)["results"]}
+
+    for r in current["results"]:
+        key = (r["benchmark"], r["map"])
+        if key in baseline:
+            print(f"{r['map']:>24} {r['benchmark']:>30} {r['per_call_us'] / baseline[key]:>8.2f}x", file=sys.stderr)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time the planner hot paths on stored allocation fixtures.")
+    parser.add_argument("--maps", nargs="+", default=None)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None, help="JSON file for the results (default: stdout)")
+    parser.add_argument("--compare", default=None, help="Earlier JSON output to compare against")
+    parser.add_argument("--make-fixtures", action="store_true", help="Regenerate the fixtures with the MILP (Gurobi)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.make_fixtures:
+        make_fixtures()
+
+    results = run_benchmarks(args.maps, args.repeat)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=1)
+    else:
+        print(json.dumps(results, indent=1))
+
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,93 @@
+import copy
+import json
+from collections.abc import Mapping
+
+import numpy as np
+
+
+def delay_model(delaysProb):
+    # The planner, Verify, FindConflict, Run_Simulation and SimulationCore take either a DelayModel or the dict of
+    # one delay probability per agent
+    return delaysProb if isinstance(delaysProb, DelayModel) else DelayModel(delaysProb)
+
+
+def read_delay_causes(file_path):
+    # The cell and time delays of the experiment drivers, from a JSON file {"cellDelays": {cell: prob, ...},
+    # "timeDelays": [prob, ...]} where either key may be left out
+    with open(file_path, mode="r", encoding="utf-8") as file:
+        causes = json.load(file)
+    cellDelays = {int(cell): prob for cell, prob in causes.get("cellDelays", {}).items()}
+    return cellDelays, causes.get("timeDelays")
+
+
+########################################################## Delay Model Class #####################################################3
+
+class DelayModel(Mapping):
+    # Probability that an agent is delayed at a timestep, from independent causes: the agent itself, the cell it is
+    # in (congested zones) and the timestep. An agent moves on with probability
+    #   (1 - agentDelays[agent]) * (1 - cellDelays[cell]) * (1 - timeDelays[t])
+    # where cellDelays is a dict (cells not in it are never delayed) and timeDelays a sequence whose last value
+    # holds for all later timesteps. As a mapping, agent -> the largest delay probability the agent can have, so
+    # code written for the dict of scalars (delay windows, checks for no delays) holds as a bound
+    def __init__(self, agentDelays, cellDelays=None, timeDelays=None):
+        self.agentDelays = dict(agentDelays)
+        self.cellMove = None
+        self.timeMove = None
+        # Move probability factor of a cell, indexed by cell; the last entry stands for every cell past the array
+        if cellDelays:
+            self.cellMove = np.ones(max(cellDelays) + 2, dtype=np.float64)
+            for cell, prob in cellDelays.items():
+                self.cellMove[cell] = 1 - prob
+        if timeDelays is not None and len(timeDelays) > 0:
+            self.timeMove = 1 - np.array(timeDelays, dtype=np.float64)
+
+        self.setBounds()
+
+    def setBounds(self):
+        # Whether the delay probability depends on more than the agent, which needs a draw per cell and timestep
+        self.varying = self.cellMove is not None or self.timeMove is not None
+        # Smallest move probability factor of any cell and timestep
+        self.minMove = 1.0
+        if self.cellMove is not None:
+            self.minMove *= float(self.cellMove.min())
+        if self.timeMove is not None:
+            self.minMove *= float(self.timeMove.min())
+        self.bounds = {agent: 1 - (1 - prob) * self.minMove for agent, prob in self.agentDelays.items()}
+        self.anyDelays = any(bound > 0 for bound in self.bounds.values())
+
+    def __getitem__(self, agent):
+        return self.bounds[agent]
+
+    def __iter__(self):
+        return iter(self.bounds)
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def shifted(self, offset):
+        # The same model for a plan that starts at timestep offset (a replan during execution): timesteps of the
+        # plan are counted from 0
+        model = copy.copy(self)
+        if self.timeMove is not None:
+            model.timeMove = self.timeMove[min(offset, len(self.timeMove) - 1):]
+            # The timesteps already past no longer bound the delays
+            model.setBounds()
+        return model
+
+    ############################################### Bulk Sampling ####################################################
+    def agentMoveProbs(self, agents):
+        return 1 - np.array([self.agentDelays[agent] for agent in agents], dtype=np.float64)
+
+    def moveProbs(self, agentMove, cells, t):
+        # Move probabilities at timestep t of agents with move probabilities agentMove (from agentMoveProbs) in the
+        # given cells, an array of any shape that broadcasts against agentMove (e.g. trials x agents)
+        moveProb = agentMove
+        if self.cellMove is not None:
+            moveProb = moveProb * self.cellMove[np.minimum(cells, len(self.cellMove) - 1)]
+        if self.timeMove is not None:
+            moveProb = moveProb * self.timeMove[min(t, len(self.timeMove) - 1)]
+        return moveProb
+
+    def maxDelayProbs(self, agentMove):
+        # Largest delay probability of agents with move probabilities agentMove, over all cells and timesteps
+        return 1 - agentMove * self.minMove
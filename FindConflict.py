@@ -1,7 +1,10 @@
 import heapq
 import random
+from collections import defaultdict
 from itertools import combinations
 
+from DelayModel import delay_model
+
 def create_loc_times(path):
     locTimes = {}
     for i, loc in enumerate(path["path"]):
@@ -57,15 +60,205 @@ def findConflictWithoutDelays(N):
     return None
 
 
+def allConflictsWithoutDelays(N):
+    # The earliest vertex conflict and the earliest edge conflict of every pair of agents
+    for agent1, agent2 in combinations(N.paths.keys(), 2):
+        path1 = N.paths[agent1]["path"]
+        path2 = N.paths[agent2]["path"]
+
+        common_locs = {(i, loc) for i, loc in enumerate(path1)} & {(i, loc) for i, loc in enumerate(path2)}
+        if len(common_locs) != 0:
+            time, loc = min(common_locs)
+            yield 0, time, None, loc, (agent1, time), (agent2, time)
+
+        edgeTimes2 = {(i + 1, (path2[i], path2[i + 1])) for i in range(len(path2) - 1) if path2[i] != path2[i + 1]}
+        for i in range(len(path1) - 1):
+            if path1[i] != path1[i + 1] and (i + 1, (path1[i + 1], path1[i])) in edgeTimes2:
+                yield 0, i + 1, None, frozenset((path1[i], path1[i + 1])), (agent1, i + 1), (agent2, i + 1)
+                break
+
+
+def conflictingPairsWithoutDelays(N):
+    # Pairs of agents that share a vertex at the same time or swap along an edge
+    occupied = defaultdict(list)
+    traversed = {}
+    pairs = set()
+
+    for agent, info in N.paths.items():
+        path = info["path"]
+        for i, loc in enumerate(path):
+            for other in occupied[(i, loc)]:
+                pairs.add((other, agent))
+            occupied[(i, loc)].append(agent)
+
+        for i in range(len(path) - 1):
+            if path[i] != path[i + 1]:
+                other = traversed.get((i + 1, path[i + 1], path[i]))
+                if other is not None:
+                    pairs.add((other, agent))
+                traversed[(i + 1, path[i], path[i + 1])] = agent
+
+    return pairs
+
+
+def maximalMatchingSize(edges):
+    matched = set()
+    for u, v in edges:
+        if u not in matched and v not in matched:
+            matched.update((u, v))
+    return len(matched) // 2
+
+
+def minimumVertexCover(edges, budget=20000):
+    # Exact branch and bound; if the budget runs out, a maximal matching (also a lower bound) is used instead
+    adjacency = defaultdict(set)
+    for u, v in edges:
+        adjacency[u].add(v)
+        adjacency[v].add(u)
+
+    best = [len(adjacency)]
+    calls = [0]
+
+    def search(adj, size):
+        calls[0] += 1
+        if calls[0] > budget:
+            raise TimeoutError
+        remaining = [(u, v) for u in adj for v in adj[u] if u < v]
+        if not remaining:
+            best[0] = min(best[0], size)
+            return
+        if size + maximalMatchingSize(remaining) >= best[0]:
+            return
+
+        u = max(adj, key=lambda vertex: len(adj[vertex]))
+        for cover in ({u}, set(adj[u])):
+            reduced = {vertex: neighbors - cover for vertex, neighbors in adj.items() if vertex not in cover}
+            search({vertex: neighbors for vertex, neighbors in reduced.items() if neighbors}, size + len(cover))
+
+    try:
+        search({vertex: set(neighbors) for vertex, neighbors in adjacency.items()}, 0)
+    except TimeoutError:
+        return maximalMatchingSize(edges)
+    return best[0]
+
+
 class FindConflict:
-    def __init__(self, delaysProb):
+    def __init__(self, delaysProb, mddBuilder=None, prioritizeCardinal=False):
         self.randGen = random.Random(42)
-        self.delaysProb = delaysProb
+        self.delaysProb = delay_model(delaysProb)
         self.cacheConflict = None
+        # The low-level planner, used to build MDDs for conflict classification
+        self.mddBuilder = mddBuilder
+        # Choose conflicts cardinal first, then semi-cardinal, then non-cardinal
+        self.prioritizeCardinal = prioritizeCardinal
+        # Whether two agents (identified by their low-level keys) have a cardinal conflict
+        self.pairCache = {}
+        self.maxCachedPairs = 200000
+
+    def cardinality(self, N, conflict):
+        # 0 = cardinal, 1 = semi-cardinal, 2 = non-cardinal
+        _, _, _, x, (agent1, time1), (agent2, time2) = conflict
+        return 2 - self.mddBuilder.isCardinal(N, agent1, x, time1) - self.mddBuilder.isCardinal(N, agent2, x, time2)
+
+    def pushConflict(self, heap, N, conflict):
+        if not self.prioritizeCardinal:
+            heapq.heappush(heap, conflict)
+        else:
+            heapq.heappush(heap, (self.cardinality(N, conflict), conflict))
+
+    def popConflict(self, heap):
+        if not heap:
+            return None
+        if not self.prioritizeCardinal:
+            return heapq.heappop(heap)
+        return heapq.heappop(heap)[1]
+
+    def pairHasCardinalConflict(self, N, agent1, agent2):
+        key = (self.mddBuilder.agentKey(N, agent1), self.mddBuilder.agentKey(N, agent2))
+        if key in self.pairCache:
+            return self.pairCache[key]
+
+        path1, path2 = N.paths[agent1]["path"], N.paths[agent2]["path"]
+        locTimes2 = {(i, loc) for i, loc in enumerate(path2)}
+        edgeTimes2 = {(i + 1, path2[i], path2[i + 1]) for i in range(len(path2) - 1)}
+
+        conflicts = [(loc, i) for i, loc in enumerate(path1) if (i, loc) in locTimes2]
+        conflicts += [(frozenset((path1[i], path1[i + 1])), i + 1) for i in range(len(path1) - 1)
+                      if path1[i] != path1[i + 1] and (i + 1, path1[i + 1], path1[i]) in edgeTimes2]
+
+        result = any(self.mddBuilder.isCardinal(N, agent1, x, t) and self.mddBuilder.isCardinal(N, agent2, x, t)
+                     for x, t in conflicts)
+
+        if len(self.pairCache) >= self.maxCachedPairs:
+            self.pairCache.clear()
+        self.pairCache[key] = result
+        return result
+
+    def cardinalConflictHeuristic(self, N):
+        # Every cardinal conflict raises the cost of at least one of its two agents by at least 1, so the size of a
+        # minimum vertex cover of the cardinal conflict graph is an admissible bound on the cost still to be added
+        edges = [(agent1, agent2) for agent1, agent2 in conflictingPairsWithoutDelays(N)
+                 if self.pairHasCardinalConflict(N, agent1, agent2)]
+        return minimumVertexCover(edges) if edges else 0
+
+    def countConflicts(self, N, agent):
+        # Conflicts between the agent and all others: same vertex at the same time and swaps without delays,
+        # shared first-visit vertices and reversed edges under delays
+        path = N.paths[agent]["path"]
+        count = 0
+
+        if not self.delaysProb.anyDelays:
+            locTimes = {(i, loc) for i, loc in enumerate(path)}
+            edgeTimes = {(i + 1, path[i + 1], path[i]) for i in range(len(path) - 1) if path[i] != path[i + 1]}
+            for other, info in N.paths.items():
+                if other != agent:
+                    otherPath = info["path"]
+                    count += sum((i, loc) in locTimes for i, loc in enumerate(otherPath))
+                    count += sum((i + 1, otherPath[i], otherPath[i + 1]) in edgeTimes for i in range(len(otherPath) - 1))
+            return count
+
+        locTimes, edgeTimes = create_loc_times(N.paths[agent]), create_edge_times(N.paths[agent])
+        for other, info in N.paths.items():
+            if other != agent:
+                count += len(locTimes.keys() & create_loc_times(info).keys())
+                count += sum(edge[0] != edge[1] and (edge[1], edge[0]) in edgeTimes for edge in create_edge_times(info))
+        return count
+
+    def countAllConflicts(self, N):
+        # The same conflicts as countConflicts, counted once for every pair of agents
+        vertices = defaultdict(int)
+        edges = defaultdict(int)
+        count = 0
+
+        for info in N.paths.values():
+            if not self.delaysProb.anyDelays:
+                path = info["path"]
+                locs = enumerate(path)
+                moves = [(i + 1, path[i], path[i + 1]) for i in range(len(path) - 1) if path[i] != path[i + 1]]
+            else:
+                locs = create_loc_times(info).keys()
+                moves = [edge for edge in create_edge_times(info) if edge[0] != edge[1]]
+
+            for loc in locs:
+                count += vertices[loc]
+                vertices[loc] += 1
+            for move in moves:
+                count += edges[move[:-2] + (move[-1], move[-2])]
+            for move in moves:
+                edges[move] += 1
+
+        return count
 
     def findConflict(self, N):
-        if self.delaysProb[0] == 0:
-            return findConflictWithoutDelays(N)
+        if not self.delaysProb.anyDelays:
+            if not self.prioritizeCardinal:
+                return findConflictWithoutDelays(N)
+
+            heap = []
+            for order, conflict in enumerate(allConflictsWithoutDelays(N)):
+                # The enumeration order stands in for the random tie-breaker used under delays
+                self.pushConflict(heap, N, conflict[:2] + (order,) + conflict[3:])
+            return self.popConflict(heap)
 
         if self.cacheConflict is not None:
             returnConflict = self.cacheConflict
@@ -104,7 +297,7 @@ class FindConflict:
                 agent1_time, agent2_time = (Time, Time + delta) if time1 <= time2 else (Time + delta, Time)
 
                 if (loc, (agent1, agent1_time), (agent2, agent2_time)) not in allPosConstDict:
-                    heapq.heappush(heap, (
+                    self.pushConflict(heap, N, (
                         delta, Time, self.randGen.random(), loc, (agent1, agent1_time), (agent2, agent2_time)))
 
             for edge1, time1 in edgeTimes1.items():
@@ -117,29 +310,29 @@ class FindConflict:
                     agent1_time, agent2_time = (Time, Time + delta) if time1 <= time2 else (Time + delta, Time)
 
                     if (frozenset(edge1), (agent1, agent1_time), (agent2, agent2_time)) not in allPosConstDict:
-                        heapq.heappush(heap, (
+                        self.pushConflict(heap, N, (
                             delta, Time, self.randGen.random(), frozenset(edge1), (agent1, agent1_time),
                             (agent2, agent2_time)))
 
-        return heapq.heappop(heap) if heap else None
+        return self.popConflict(heap)
 
     def Check_Potential_Conflict_in_first_step(self, N):
-        potential_locs = []
+        # First claimant (agent, time) of every cell occupied at time 0 or 1
+        claims = {}
 
         for currAgent, path in N.paths.items():
             currLoc = path["path"][0]
-            for agent, loc, time in potential_locs:
-                if currLoc == loc and currAgent != agent:
-                    self.cacheConflict = (None, None, None, loc, (currAgent, 0), (agent, time))
-                    return False
-            potential_locs.append((currAgent, currLoc, 0))
+            claim = claims.get(currLoc)
+            if claim is not None:
+                self.cacheConflict = (None, None, None, currLoc, (currAgent, 0), claim)
+                return False
+            claims[currLoc] = (currAgent, 0)
 
             if len(path["path"]) > 1:
                 nextLoc = path["path"][1]
-                for agent, loc, time in potential_locs:
-                    if nextLoc == loc and currAgent != agent:
-                        self.cacheConflict = (None, None, None, loc, (currAgent, 1), (agent, time))
-                        return False
-                potential_locs.append((currAgent, nextLoc, 1))
+                claim = claims.setdefault(nextLoc, (currAgent, 1))
+                if claim[0] != currAgent:
+                    self.cacheConflict = (None, None, None, nextLoc, (currAgent, 1), claim)
+                    return False
 
         return True
@@ -0,0 +1,82 @@
+import ast
+import os
+import numpy as np
+
+instances_dir = "Agent_Goal_locations_files"
+
+# Loaded stores, keyed by store path and modification time
+_loaded_stores = {}
+
+
+def map_prefix(map_name):
+    return os.path.basename(map_name).split('.')[0]
+
+
+def store_path(map_name):
+    return os.path.join(instances_dir, f"{map_prefix(map_name)}_Map_Locs.npz")
+
+
+def text_paths(map_name, instance_index):
+    prefix = map_prefix(map_name)
+    return (os.path.join(instances_dir, f"{prefix}_Map_Agent_Locs_instance_{instance_index}.txt"),
+            os.path.join(instances_dir, f"{prefix}_Map_Goal_Locs_instance_{instance_index}.txt"))
+
+
+####################################################### Write store #################################################################################
+def write_instance_store(map_name, agents_per_instance, goals_per_instance):
+    # agents: int32 array (instances, agents), goals: int32 array (instances, goals)
+    os.makedirs(instances_dir, exist_ok=True)
+    np.savez(store_path(map_name),
+             agents=np.asarray(agents_per_instance, dtype=np.int32),
+             goals=np.asarray(goals_per_instance, dtype=np.int32))
+
+
+def read_text_instance(map_name, instance_index, num_of_agents=None, num_of_goals=None):
+    file_agents_name, file_goals_name = text_paths(map_name, instance_index)
+
+    with open(file_agents_name, "r") as f:
+        Agents_Positions = [ast.literal_eval(line.strip()) for line in f if line.strip()]
+
+    with open(file_goals_name, "r") as f:
+        Goals_Locations = [ast.literal_eval(line.strip()) for line in f if line.strip()]
+
+    return Agents_Positions[:num_of_agents], Goals_Locations[:num_of_goals]
+
+
+def convert_text_instances(map_name):
+    agents_per_instance, goals_per_instance = [], []
+    while os.path.exists(text_paths(map_name, len(agents_per_instance))[0]):
+        agents, goals = read_text_instance(map_name, len(agents_per_instance))
+        agents_per_instance.append(agents)
+        goals_per_instance.append(goals)
+
+    if not agents_per_instance:
+        raise FileNotFoundError(f"No instance files for {map_name} in {instances_dir}")
+
+    write_instance_store(map_name, agents_per_instance, goals_per_instance)
+    return len(agents_per_instance)
+
+
+####################################################### Load store #################################################################################
+def load_instance_store(map_name):
+    path = store_path(map_name)
+    key = (path, os.path.getmtime(path))
+
+    if key not in _loaded_stores:
+        with np.load(path) as data:
+            store = {"agents": data["agents"], "goals": data["goals"]}
+        store["agents"].flags.writeable = False
+        store["goals"].flags.writeable = False
+        _loaded_stores[key] = store
+
+    return _loaded_stores[key]
+
+
+def read_locs(map_name, num_of_instance, num_of_agents, num_of_goals):
+    # Instances are numbered from 1 by the drivers and stored from 0
+    if not os.path.exists(store_path(map_name)):
+        return read_text_instance(map_name, num_of_instance - 1, num_of_agents, num_of_goals)
+
+    store = load_instance_store(map_name)
+    return (store["agents"][num_of_instance - 1, :num_of_agents].tolist(),
+            store["goals"][num_of_instance - 1, :num_of_goals].tolist())
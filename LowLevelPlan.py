@@ -1,5 +1,9 @@
 import heapq
-from NodeStateClasses import State
+import math
+from collections import OrderedDict, defaultdict
+from MapLoader import blocked_cells
+from NodeStateClasses import FocalList, State
+from ReservationTable import ReservationTable
 
 
 ########################################################## Extract path #####################################################3
@@ -14,11 +18,38 @@ def extractPath(state):
 ########################################################## LowLevelPlan Class #####################################################3
 
 class LowLevelPlan:
-    def __init__(self, dict_of_map_and_dim, AgentLocations, dict_cost_for_Heuristic_value, optimize):
+    def __init__(self, dict_of_map_and_dim, AgentLocations, dict_cost_for_Heuristic_value, optimize,
+                 suboptimality=1, timedReservations=True, useReservations=False, windowDelayProb=None,
+                 maxCachedCells=0, goalWindows=None):
         self.MapAndDims = dict_of_map_and_dim
+        self.blockedCells = blocked_cells(dict_of_map_and_dim)
         self.AgentLocations = AgentLocations
         self.dict_cost_for_Heuristic_value = dict_cost_for_Heuristic_value
         self.optimize = optimize
+        # With suboptimality w > 1, paths come from a focal search and cost at most w times their lower bound
+        self.suboptimality = suboptimality
+        # Whether conflicts with other agents are timed (no delays) or first-visit based (delays)
+        self.timedReservations = timedReservations
+        # Break ties between states of equal f by conflicts with the other agents' paths
+        self.useReservations = useReservations
+        # Under delays, count only visits of other agents within a delay window of this delay probability
+        self.windowDelayProb = windowDelayProb
+        self.mddCache = {}
+        self.maxCachedMDDs = 20000
+        # LRU cache of optimal paths, capped by the total number of path cells, goals and constraints stored in
+        # its entries, keys included (0 turns it off)
+        self.pathCache = OrderedDict()
+        self.maxCachedCells = maxCachedCells
+        self.cachedCells = 0
+        self.cacheHits = 0
+        self.cacheMisses = 0
+        # States expanded by the A* and focal searches
+        self.expandedStates = 0
+        # (release, deadline) of goal locations: a goal is served only from its release on, and states that can no
+        # longer serve a remaining goal by its deadline are pruned
+        self.goalWindows = goalWindows or {}
+        # Negative constraints of the agent being searched, as time -> forbidden vertices and edges
+        self.negConstraintsByTime = {}
 
     def runLowLevelPlan(self, Node, agent_that_need_update_path):
         for agent in agent_that_need_update_path:
@@ -27,6 +58,7 @@ class LowLevelPlan:
             # If no allocations are present
             if len(sequence) == 1:
                 Node.paths[agent]["path"] = [self.AgentLocations[agent]]
+                Node.lowerBounds[agent] = Node.paths[agent]["cost"]
                 continue
 
             # Decrease the previous path cost of the current agent
@@ -35,44 +67,150 @@ class LowLevelPlan:
             else:
                 Node.g = max((data["cost"] for agent_id, data in Node.paths.items() if agent_id != agent), default=0)
 
-            findPath = False
-            OpenList = []
-            visited = {}
+            cacheKey = self.cacheKey(Node, agent, sequence)
+            agentPath = self.cachedPath(cacheKey)
 
-            S = State(self.AgentLocations[agent], sequence=[self.AgentLocations[agent]], t=0)
-            if self.optimize == "SST":
-                heapq.heappush(OpenList, (self.calc_sst_for_Heuristic_value(S, sequence), S))
+            if agentPath is None:
+                if self.suboptimality > 1:
+                    S, lowerBound = self.focalSearch(Node, agent, sequence)
+                    # The parent's bound still holds, since constraints are only ever added
+                    Node.lowerBounds[agent] = max(lowerBound, Node.lowerBounds.get(agent, 0))
+                else:
+                    S = self.aStarSearch(Node, agent, sequence)
+
+                if S is None:
+                    return False
+
+                # Extract the path from the final goal back to the start
+                agentPath = extractPath(S)
+                self.storePath(cacheKey, agentPath)
+
+            Node.paths[agent] = agentPath
+            if self.suboptimality == 1:
+                Node.lowerBounds[agent] = agentPath["cost"]
+            if self.optimize != "MAKESPAN":
+                Node.g += agentPath["cost"]
             else:
-                heapq.heappush(OpenList, (self.calc_soc_or_makespan_for_Heuristic_value(S, sequence), S))
+                Node.g = max(agentPath["cost"], Node.g)
+        return True
 
-            while OpenList:
-                _, S = heapq.heappop(OpenList)
+    def aStarSearch(self, Node, agent, sequence):
+        OpenList = []
+        visited = {}
+        self.indexConstraints(Node, agent)
+        reservations = self.reservationTable(Node, agent) if self.useReservations else None
 
-                if (S.CurLocation, tuple(S.sequence), S.t) in visited:
-                    continue
-                visited[(S.CurLocation, tuple(S.sequence), S.t)] = True
+        # Entries are (f, conflicts with other agents so far, state); the conflicts only break ties in f
+        S = State(self.AgentLocations[agent], sequence=[self.AgentLocations[agent]], t=0)
+        if self.optimize == "SST":
+            heapq.heappush(OpenList, (self.calc_sst_for_Heuristic_value(S, sequence), 0, S))
+        else:
+            heapq.heappush(OpenList, (self.calc_soc_or_makespan_for_Heuristic_value(S, sequence), 0, S))
 
-                if len(S.sequence) == len(sequence):
-                    findPath = True
-                    break
+        while OpenList:
+            _, conflicts, S = heapq.heappop(OpenList)
 
-                for Sl in self.GetNeighbors(S, agent, Node, sequence):
-                    if not visited.get((Sl.CurLocation, tuple(Sl.sequence), Sl.t), False):
-                        if self.optimize == "SST":
-                            heapq.heappush(OpenList, (self.calc_sst_for_Heuristic_value(Sl, sequence) + Sl.g, Sl))
-                        else:
-                            heapq.heappush(OpenList, (self.calc_soc_or_makespan_for_Heuristic_value(Sl, sequence) + Sl.g, Sl))
+            if (S.CurLocation, tuple(S.sequence), S.t) in visited:
+                continue
+            visited[(S.CurLocation, tuple(S.sequence), S.t)] = True
+            self.expandedStates += 1
+
+            if len(S.sequence) == len(sequence):
+                return S
+
+            for Sl in self.GetNeighbors(S, agent, Node, sequence):
+                if not visited.get((Sl.CurLocation, tuple(Sl.sequence), Sl.t), False):
+                    slConflicts = conflicts
+                    if reservations is not None:
+                        slConflicts += reservations.conflicts(S.CurLocation, Sl.CurLocation, Sl.t)
+                    if self.optimize == "SST":
+                        heapq.heappush(OpenList, (self.calc_sst_for_Heuristic_value(Sl, sequence) + Sl.g, slConflicts, Sl))
+                    else:
+                        heapq.heappush(OpenList, (self.calc_soc_or_makespan_for_Heuristic_value(Sl, sequence) + Sl.g, slConflicts, Sl))
+
+        return None
+
+    ########################################################## Path cache #####################################################
+    def cacheKey(self, Node, agent, sequence):
+        # Without focal search or reservations a path depends only on the agent's start, goals and own constraints
+        if self.maxCachedCells <= 0 or self.suboptimality > 1 or self.useReservations:
+            return None
+        return (agent, self.AgentLocations[agent], tuple(sequence),
+                frozenset(Node.negConstraints.get(agent, ())), frozenset(Node.posConstraints.get(agent, ())))
+
+    def cachedPath(self, key):
+        if key is None:
+            return None
+        if key not in self.pathCache:
+            self.cacheMisses += 1
+            return None
+
+        self.cacheHits += 1
+        self.pathCache.move_to_end(key)
+        path, cost = self.pathCache[key]
+        return {"path": list(path), "cost": cost}
+
+    def storePath(self, key, agentPath):
+        if key is None:
+            return
+        if key in self.pathCache:
+            self.cachedCells -= self.entrySize(key, self.pathCache[key][0])
+        self.pathCache[key] = (tuple(agentPath["path"]), agentPath["cost"])
+        self.cachedCells += self.entrySize(key, self.pathCache[key][0])
+
+        # Evict the least recently used paths until the stored cells fit the cap
+        while self.cachedCells > self.maxCachedCells:
+            oldKey, (path, _) = self.pathCache.popitem(last=False)
+            self.cachedCells -= self.entrySize(oldKey, path)
+
+    @staticmethod
+    def entrySize(key, path):
+        # Deep in the CT the constraints of a key can outgrow its path, so they count against the cap as well
+        _, _, sequence, negConstraints, posConstraints = key
+        return len(path) + len(sequence) + len(negConstraints) + len(posConstraints)
+
+    def reservationTable(self, Node, agent):
+        return ReservationTable(self.MapAndDims["Rows"] * self.MapAndDims["Cols"], Node.paths, agent,
+                                self.timedReservations, self.windowDelayProb)
+
+    def focalSearch(self, Node, agent, sequence):
+        # Among states within w times the lowest f, expand the one whose path has the fewest conflicts with the
+        # other agents' current paths. Returns the goal state and the agent's lower bound (lowest f at the end).
+        reservations = self.reservationTable(Node, agent)
+        FocalOpenList = FocalList(self.suboptimality)
+        closed = {}
+        self.indexConstraints(Node, agent)
+
+        S = State(self.AgentLocations[agent], sequence=[self.AgentLocations[agent]], t=0)
+        f = self.heuristic(S, sequence)
+        FocalOpenList.put((S, 0), f, f, (0, f))
+
+        while not FocalOpenList.empty():
+            lowerBound = FocalOpenList.lowerBound()
+            S, conflicts = FocalOpenList.get()
+
+            # A state may be reached again with a lower g, so closed states are reopened when that happens
+            key = (S.CurLocation, tuple(S.sequence), S.t)
+            if closed.get(key, math.inf) <= S.g:
+                continue
+            closed[key] = S.g
+            self.expandedStates += 1
 
-            if not findPath:
-                return False
+            if len(S.sequence) == len(sequence):
+                return S, lowerBound
 
-            # Extract the path from the final goal back to the start
-            Node.paths[agent] = extractPath(S)
-            if self.optimize != "MAKESPAN":
-                Node.g += S.g
-            else:
-                Node.g = max(S.g, Node.g)
-        return True
+            for Sl in self.GetNeighbors(S, agent, Node, sequence):
+                if closed.get((Sl.CurLocation, tuple(Sl.sequence), Sl.t), math.inf) > Sl.g:
+                    f = Sl.g + self.heuristic(Sl, sequence)
+                    slConflicts = conflicts + reservations.conflicts(S.CurLocation, Sl.CurLocation, Sl.t)
+                    FocalOpenList.put((Sl, slConflicts), f, f, (slConflicts, f))
+
+        return None, math.inf
+
+    def indexConstraints(self, Node, agent):
+        self.negConstraintsByTime = defaultdict(set)
+        for _, x, t in Node.negConstraints.get(agent, ()):
+            self.negConstraintsByTime[t].add(x)
 
     ########################################################## calc cost for Heuristic value #####################################################
     def calc_sst_for_Heuristic_value(self, S, sequence):
@@ -103,6 +241,11 @@ class LowLevelPlan:
 
         return soc_remaining
 
+    def heuristic(self, S, sequence):
+        if self.optimize == "SST":
+            return self.calc_sst_for_Heuristic_value(S, sequence)
+        return self.calc_soc_or_makespan_for_Heuristic_value(S, sequence)
+
     def GetNeighbors(self, state, agent, Node, sequence):
         neighbors = []
         loc = state.CurLocation
@@ -115,7 +258,7 @@ class LowLevelPlan:
             canMove = self.validateMove(loc_after_move, agent, state, Node)
 
             if canMove == 1:
-                if loc_after_move == sequence[len(state.sequence)] and state.sequence == sequence[:len(state.sequence)]:
+                if self.servesGoal(loc_after_move, state, sequence, False):
                     afterMoveStateSequence = state.sequence + [sequence[len(state.sequence)]]
                 else:
                     afterMoveStateSequence = state.sequence[:]
@@ -124,11 +267,37 @@ class LowLevelPlan:
                 neighbors.append(State(loc_after_move, state.g + step_cost, state, afterMoveStateSequence, state.t + 1))
 
             if self.validateMove(loc, agent, state, Node) == 1:
+                if self.servesGoal(loc, state, sequence, True):
+                    stayStateSequence = state.sequence + [sequence[len(state.sequence)]]
+                else:
+                    stayStateSequence = state.sequence[:]
+
                 step_cost = (len(sequence) - len(state.sequence)) if self.optimize == "SST" else 1
-                neighbors.append(State(loc, state.g + step_cost, state, state.sequence[:], state.t + 1))
+                neighbors.append(State(loc, state.g + step_cost, state, stayStateSequence, state.t + 1))
 
+        if self.goalWindows:
+            return [Sl for Sl in neighbors if not self.missesDeadline(Sl, sequence)]
         return neighbors
 
+    def servesGoal(self, loc_after_move, state, sequence, stay):
+        if loc_after_move != sequence[len(state.sequence)] or state.sequence != sequence[:len(state.sequence)]:
+            return False
+
+        # Staying on a goal serves it only when the agent arrived there before its release
+        release = self.goalWindows.get(loc_after_move, (0, None))[0]
+        return state.t + 1 >= release and (not stay or release > 0)
+
+    def missesDeadline(self, S, sequence):
+        # Earliest time each remaining goal can be served, by shortest distances and releases
+        t, current_loc = S.t, S.CurLocation
+        for i in range(len(S.sequence), len(sequence)):
+            release, deadline = self.goalWindows.get(sequence[i], (0, None))
+            t = max(t + self.dict_cost_for_Heuristic_value[(current_loc, sequence[i])], release)
+            if deadline is not None and t > deadline:
+                return True
+            current_loc = sequence[i]
+        return False
+
     ########################################################## validate Move #####################################################
     def validateMove(self, loc_after_move, agent, state, Node):
         # Extract the agent's location and direction before taking the next step
@@ -146,13 +315,13 @@ class LowLevelPlan:
         if (col_loc == 0 and col_after == cols - 1) or (col_loc == cols - 1 and col_after == 0):
             return 0
 
-        if self.MapAndDims["Map"][loc_after_move] != 0:
+        if self.blockedCells[loc_after_move] != 0:
             return 0
 
         # Check if the move violates any negative constraints
-        for z, x, t in Node.negConstraints[agent]:
-            if t == state.t + 1 and (x == loc_after_move or x == frozenset((loc, loc_after_move))):
-                return 0
+        forbidden = self.negConstraintsByTime.get(state.t + 1)
+        if forbidden and (loc_after_move in forbidden or frozenset((loc, loc_after_move)) in forbidden):
+            return 0
 
         for agent1, agent2, x, t1, t2 in Node.posConstraints[agent]:
             if agent1 == agent and t1 == state.t + 1 and (
@@ -164,3 +333,77 @@ class LowLevelPlan:
                 return 0
 
         return 1
+
+    ########################################################## MDD #####################################################
+    def agentKey(self, Node, agent):
+        # Everything an agent's low-level search depends on: its allocation, its cost and its own constraints
+        return (agent, tuple(Node.sequence["Allocations"][agent]), Node.paths[agent]["cost"],
+                frozenset(Node.negConstraints.get(agent, ())), frozenset(Node.posConstraints.get(agent, ())))
+
+    def buildMDD(self, Node, agent):
+        # Returns, per timestep, the set of locations the agent occupies on some path of its current cost.
+        # None in a level means the agent may already have served its last goal and left.
+        key = self.agentKey(Node, agent)
+        if key in self.mddCache:
+            return self.mddCache[key]
+
+        sequence = Node.sequence["Allocations"][agent]
+        cost = Node.paths[agent]["cost"]
+        self.indexConstraints(Node, agent)
+
+        # Forward pass: lowest g of every (location, goals reached) state per timestep, pruned by f > cost
+        layers = [{(self.AgentLocations[agent], 1): 0}]
+        parents = [{}]
+        goalStates = []
+        while layers[-1]:
+            t = len(layers) - 1
+            nextLayer, nextParents = {}, {}
+
+            for (loc, reached), g in layers[-1].items():
+                if reached == len(sequence):
+                    if g == cost:
+                        goalStates.append((t, (loc, reached)))
+                    continue
+
+                S = State(loc, g, None, sequence[:reached], t)
+                for Sl in self.GetNeighbors(S, agent, Node, sequence):
+                    if Sl.g + self.heuristic(Sl, sequence) > cost:
+                        continue
+
+                    state = (Sl.CurLocation, len(Sl.sequence))
+                    if state not in nextLayer or Sl.g < nextLayer[state]:
+                        nextLayer[state] = Sl.g
+                        nextParents[state] = [(loc, reached)]
+                    elif Sl.g == nextLayer[state]:
+                        nextParents[state].append((loc, reached))
+
+            layers.append(nextLayer)
+            parents.append(nextParents)
+
+        # Backward pass: keep only states from which a goal state of exactly this cost is reached
+        levels = [set() for _ in layers]
+        marked = set(goalStates)
+        stack = list(goalStates)
+        while stack:
+            t, state = stack.pop()
+            levels[t].add(state[0])
+            for parent in parents[t].get(state, ()):
+                if (t - 1, parent) not in marked:
+                    marked.add((t - 1, parent))
+                    stack.append((t - 1, parent))
+
+        if goalStates:
+            for t in range(min(t for t, _ in goalStates) + 1, len(levels)):
+                levels[t].add(None)
+
+        if len(self.mddCache) >= self.maxCachedMDDs:
+            self.mddCache.clear()
+        self.mddCache[key] = [frozenset(level) for level in levels]
+        return self.mddCache[key]
+
+    def isCardinal(self, Node, agent, x, t):
+        # True if every path of the agent's current cost uses vertex/edge x at time t
+        mdd = self.buildMDD(Node, agent)
+        if isinstance(x, frozenset):
+            return 0 < t < len(mdd) and len(mdd[t - 1]) == 1 and len(mdd[t]) == 1 and (mdd[t - 1] | mdd[t]) == x
+        return t < len(mdd) and mdd[t] == {x}
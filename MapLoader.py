@@ -0,0 +1,75 @@
+import os
+from collections import defaultdict, deque
+import numpy as np
+
+maps_dir = "Maps"
+
+# Parsed maps, keyed by absolute path and modification time
+_loaded_maps = {}
+
+
+def map_path(map_name):
+    if os.path.exists(map_name):
+        return map_name
+    file_name = map_name if map_name.endswith(".map") else f"{map_name}.map"
+    return os.path.join(maps_dir, file_name)
+
+
+####################################################### Load map #################################################################################
+def parse_map_file(file_path):
+    with open(file_path, "rb") as f:
+        lines = f.read().splitlines()
+
+    map_start_index = [line.strip() for line in lines].index(b"map") + 1
+    map_lines = [line.strip() for line in lines[map_start_index:] if line.strip()]
+    rows, cols = len(map_lines), len(map_lines[-1])
+
+    # One pass over the whole grid: "." is free (0), anything else is an obstacle (1)
+    cells = np.frombuffer(b"".join(map_lines), dtype=np.uint8)
+    grid = (cells != ord(".")).astype(np.uint8)
+    grid.flags.writeable = False
+
+    return {"Rows": rows, "Cols": cols, "Map": grid}
+
+
+def load_map(map_name):
+    file_path = os.path.abspath(map_path(map_name))
+    key = (file_path, os.path.getmtime(file_path))
+
+    if key not in _loaded_maps:
+        _loaded_maps[key] = parse_map_file(file_path)
+
+    # A new dict around the same read-only grid, so callers never share or mutate each other's entries
+    return dict(_loaded_maps[key])
+
+
+def blocked_cells(MapAndDims):
+    # bytes gives the fastest per-cell lookup in the search loops and accepts both lists and uint8 grids
+    return np.asarray(MapAndDims["Map"], dtype=np.uint8).tobytes()
+
+
+####################################################### Goal distances #################################################################################
+def precompute_costs(MapAndDims, GoalLocations):
+    # Shortest distance from every cell to every goal, keyed by (cell, goal); unreachable pairs cost 1000000
+    precomputed_cost = defaultdict(lambda: 1000000)
+    blockedCells = blocked_cells(MapAndDims)
+    cols, max_cells = MapAndDims["Cols"], MapAndDims["Cols"] * MapAndDims["Rows"]
+
+    for goal in GoalLocations:
+        visited = np.zeros(max_cells, dtype=bool)
+        visited[goal] = True
+        queue = deque([(goal, 0)])
+
+        while queue:
+            current_loc, cost = queue.popleft()
+            precomputed_cost[(current_loc, goal)] = cost
+
+            col = current_loc % cols
+            for neighbor_loc, allowed in ((current_loc + 1, col != cols - 1), (current_loc + cols, True),
+                                          (current_loc - 1, col != 0), (current_loc - cols, True)):
+                if allowed and 0 <= neighbor_loc < max_cells and not visited[neighbor_loc] and \
+                        blockedCells[neighbor_loc] == 0:
+                    visited[neighbor_loc] = True
+                    queue.append((neighbor_loc, cost + 1))
+
+    return precomputed_cost
@@ -1,4 +1,7 @@
+import heapq
+import math
 from collections import defaultdict
+from collections.abc import Mapping
 from functools import total_ordering
 
 
@@ -8,8 +11,40 @@ class Node:
         self.negConstraints = defaultdict(set)
         self.posConstraints = defaultdict(set)
         self.g = 0
+        # Admissible estimate of the cost still to be added below this node (0 unless the conflict heuristic is on)
+        self.h = 0
+        # Lower bound on each agent's optimal cost under the node's constraints (the cost itself in optimal mode)
+        self.lowerBounds = {}
+        # Proven ratio between the node's cost and the best possible cost when it was selected
+        self.bound = 1
+        self.numOfConflicts = 0
+        # Id of the node in the search trace, when tracing
+        self.traceId = 0
         self.sequence = {}
         self.isPositiveNode = False
+        # Flat (negative, positive) constraints of a node whose paths were dropped to save memory, else None
+        self.compressed = None
+
+    def compress(self):
+        # Keeps the constraints as two flat tuples and drops the paths; restore() and a replan of every agent
+        # bring the node back
+        self.compressed = (tuple(cons for constraints in self.negConstraints.values() for cons in constraints),
+                           tuple({cons for constraints in self.posConstraints.values() for cons in constraints}))
+        self.paths = None
+        self.negConstraints = None
+        self.posConstraints = None
+
+    def restore(self):
+        negConstraints, posConstraints = self.compressed
+        self.compressed = None
+        self.paths = defaultdict(lambda: {"path": [], "cost": 0})
+        self.negConstraints = defaultdict(set)
+        for cons in negConstraints:
+            self.negConstraints[cons[0]].add(cons)
+        self.posConstraints = defaultdict(set)
+        for cons in posConstraints:
+            self.posConstraints[cons[0]].add(cons)
+            self.posConstraints[cons[1]].add(cons)
 
     def __lt__(self, other):
         return self.g < other.g
@@ -18,6 +53,51 @@ class Node:
         return self.g == other.g
 
 
+class DeltaPaths(Mapping):
+    # Agent -> path mapping of a CT node that holds only the paths replanned in the node; the others are looked up
+    # in the parent's mapping, up the chain of ancestors to the root's dict. materialize() flattens the chain into
+    # one dict for a node that is read often (the node being expanded, whose children look up through it)
+    def __init__(self, parent):
+        self.parent = parent
+        self.own = {}
+        self.resolved = None
+
+    def __getitem__(self, agent):
+        paths = self
+        while isinstance(paths, DeltaPaths):
+            if paths.resolved is not None:
+                return paths.resolved[agent]
+            if agent in paths.own:
+                return paths.own[agent]
+            paths = paths.parent
+        return paths[agent]
+
+    def __setitem__(self, agent, info):
+        self.own[agent] = info
+        if self.resolved is not None:
+            self.resolved[agent] = info
+
+    def root(self):
+        paths = self
+        while isinstance(paths, DeltaPaths):
+            paths = paths.parent
+        return paths
+
+    def __iter__(self):
+        # The root holds every agent, in agent order
+        return iter(self.root())
+
+    def __len__(self):
+        return len(self.root())
+
+    def materialize(self):
+        if self.resolved is None:
+            self.resolved = {agent: self[agent] for agent in self.root()}
+
+    def release(self):
+        self.resolved = None
+
+
 @total_ordering
 class State:
     def __init__(self, CurLocation, g=0, parent=None, sequence=[], t=0):
@@ -41,3 +121,64 @@ class State:
     # Define less-than for ordering, based on cost g
     def __lt__(self, other):
         return self.g < other.g
+
+
+class FocalList:
+    # OPEN ordered by a lower bound f, FOCAL holding the entries whose cost is within w times the smallest f,
+    # ordered by a secondary key (e.g. number of conflicts). Entries move between the two lazily in get().
+    def __init__(self, suboptimality):
+        self.suboptimality = suboptimality
+        self.openList = []
+        self.waitingList = []
+        self.focalList = []
+        self.entries = {}
+        self.counter = 0
+
+    def put(self, item, f, cost, key):
+        self.counter += 1
+        self.entries[self.counter] = item
+        heapq.heappush(self.openList, (f, self.counter))
+        heapq.heappush(self.waitingList, (cost, self.counter, key))
+
+    def empty(self):
+        return not self.entries
+
+    def qsize(self):
+        return len(self.entries)
+
+    def ranked(self):
+        # (f, id) of every entry, smallest f first
+        return sorted((f, count) for f, count in self.openList if count in self.entries)
+
+    def item(self, count):
+        return self.entries[count]
+
+    def remove(self, count):
+        # The heaps drop the entry lazily
+        del self.entries[count]
+
+    def lowerBound(self):
+        while self.openList and self.openList[0][1] not in self.entries:
+            heapq.heappop(self.openList)
+        return self.openList[0][0] if self.openList else math.inf
+
+    def get(self):
+        threshold = self.suboptimality * self.lowerBound()
+
+        while self.waitingList and self.waitingList[0][0] <= threshold:
+            cost, count, key = heapq.heappop(self.waitingList)
+            if count in self.entries:
+                heapq.heappush(self.focalList, (key, cost, count))
+
+        while self.focalList:
+            key, cost, count = heapq.heappop(self.focalList)
+            if count not in self.entries:
+                continue
+            # The bound may have dropped since the entry was moved to FOCAL
+            if cost > threshold:
+                heapq.heappush(self.waitingList, (cost, count, key))
+                continue
+            return self.entries.pop(count)
+
+        # Only if an entry's cost exceeds w times its own f: fall back to the entry with the smallest f
+        return self.entries.pop(heapq.heappop(self.openList)[1])
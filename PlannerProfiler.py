@@ -0,0 +1,132 @@
+import glob
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+# Set to a directory to profile every planner call of the drivers, one collapsed-stack file per call
+profile_dir_variable = "ROBUST_PLANNER_PROFILE_DIR"
+# Seconds of CPU time between samples
+sample_interval = 0.002
+# Samples queued by the signal handler before it folds them into the stack counts
+fold_threshold = 1024
+
+
+def profile_path(name, instance, safe_prob, replan):
+    profile_dir = os.environ.get(profile_dir_variable)
+    if not profile_dir:
+        return None
+
+    os.makedirs(profile_dir, exist_ok=True)
+    return os.path.join(profile_dir, f"{name}_instance_{instance}_safe_prob_{safe_prob}_replan_{replan}.folded")
+
+
+########################################################## Sampling Profiler Class #####################################################3
+
+class SamplingProfiler:
+    # Samples the main thread's stack on SIGPROF (every sample_interval seconds of CPU time) and writes the counts
+    # in collapsed-stack format ("file:function;file:function count", root first), which flamegraph tools read.
+    # Python only handles the signal between bytecodes, so each sample is weighted by the CPU time since the last
+    # one and time in C calls (Gurobi) goes to the calling line. Unix only.
+    def __init__(self, file_path):
+        self.file_path = file_path
+        # The signal handler only appends to samples (an atomic deque append) and folds them into stacks when it
+        # gets the lock without waiting; write() takes the lock, so stacks never changes while it is written out
+        self.samples = deque()
+        self.stacks = Counter()
+        self.lastSample = time.process_time()
+        self.mainThreadId = threading.get_ident()
+        # Stacks stop at the caller of start(), leaving out the frames of the process that forked this one
+        self.rootParent = None
+        self.lock = threading.Lock()
+        self.written = False
+
+    def start(self):
+        self.rootParent = sys._getframe(1).f_back
+        signal.signal(signal.SIGPROF, self.sample)
+        # Restart system calls the signal interrupts, since native code (Gurobi) may not retry on EINTR
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, sample_interval, sample_interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        self.write()
+
+    def sample(self, signum, frame):
+        self.record(frame)
+
+    def record(self, frame):
+        now = time.process_time()
+        weight = round((now - self.lastSample) / sample_interval)
+        if weight == 0:
+            return
+        self.lastSample = now
+
+        stack = []
+        while frame is not None and frame is not self.rootParent:
+            stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+            frame = frame.f_back
+        self.samples.append((";".join(reversed(stack)), weight))
+
+        # The handler may interrupt the thread that holds the lock, so it never waits for it
+        if len(self.samples) >= fold_threshold and self.lock.acquire(blocking=False):
+            try:
+                self.fold()
+            finally:
+                self.lock.release()
+
+    def fold(self):
+        # Called with the lock held
+        while True:
+            try:
+                stack, weight = self.samples.popleft()
+            except IndexError:
+                return
+            self.stacks[stack] += weight
+
+    def flush(self):
+        # Writes the profile from another thread, when the process is about to be terminated on timeout: the main
+        # thread may be inside the solver and unable to run a signal handler
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        # The CPU time since the last sample goes to wherever the main thread is now
+        self.record(sys._current_frames().get(self.mainThreadId))
+        self.write()
+
+    def write(self):
+        with self.lock:
+            if self.written:
+                return
+            self.written = True
+            self.fold()
+            with open(self.file_path, "w", encoding="utf-8") as file:
+                for stack, count in self.stacks.most_common():
+                    file.write(f"{stack} {count}\n")
+
+
+####################################################### Aggregate #################################################################################
+def aggregate_profiles(file_paths):
+    stacks = Counter()
+    for file_path in file_paths:
+        with open(file_path, "r", encoding="utf-8") as file:
+            for line in file:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                if stack:
+                    stacks[stack] += int(count)
+    return stacks
+
+
+if __name__ == "__main__":
+    # python PlannerProfiler.py OUTPUT PROFILE_OR_DIR... -> one collapsed-stack file summing all the inputs
+    if len(sys.argv) < 3:
+        sys.exit("usage: python PlannerProfiler.py OUTPUT PROFILE_OR_DIR...")
+
+    inputs = []
+    for path in sys.argv[2:]:
+        inputs.extend(sorted(glob.glob(os.path.join(path, "*.folded"))) if os.path.isdir(path) else [path])
+
+    with open(sys.argv[1], "w", encoding="utf-8") as output:
+        for stack, count in aggregate_profiles(inputs).most_common():
+            output.write(f"{stack} {count}\n")
+    print(f"{len(inputs)} profiles aggregated into {sys.argv[1]}")
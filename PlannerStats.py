@@ -0,0 +1,94 @@
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Cumulative counters of one planner run, with times in seconds. The planner phases are the k-best MILP, the
+# low-level search, conflict detection (FindConflict) and Verify
+STATS_COLUMNS = {
+    "milpTime": "MILP Time",
+    "milpCalls": "MILP Calls",
+    "lowLevelTime": "Low Level Time",
+    "lowLevelCalls": "Low Level Calls",
+    "lowLevelExpanded": "Low Level Expands",
+    "findConflictTime": "Find Conflict Time",
+    "findConflictCalls": "Find Conflict Calls",
+    "verifyTime": "Verify Time",
+    "verifyCalls": "Verify Calls",
+    "simulations": "Simulations",
+    "rootsGenerated": "Roots Generated",
+    "peakOpen": "Peak Open Size",
+    "peakRss": "Peak RSS MB",
+    "nodesCompressed": "Nodes Compressed",
+    "nodesPruned": "Nodes Pruned",
+}
+STATS_FIELDS = tuple(STATS_COLUMNS)
+# Fields that keep the largest value seen instead of a sum
+PEAK_FIELDS = ("peakOpen", "peakRss")
+
+
+########################################################## Planner Stats Class #####################################################3
+
+class PlannerStats:
+    # values is a list, or a shared ctypes array when the planner runs in its own process, so that the counters
+    # are still readable after the process is terminated on timeout
+    def __init__(self, values=None):
+        self.values = values if values is not None else [0.0] * len(STATS_FIELDS)
+        self.index = {field: i for i, field in enumerate(STATS_FIELDS)}
+
+    def add(self, field, amount=1):
+        self.values[self.index[field]] += amount
+
+    def set(self, field, value):
+        self.values[self.index[field]] = value
+
+    def peak(self, field, value):
+        if value > self.values[self.index[field]]:
+            self.values[self.index[field]] = value
+
+    @contextmanager
+    def timed(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase + "Time", time.perf_counter() - start)
+            self.add(phase + "Calls")
+
+    def asDict(self):
+        return {field: round(self.values[i], 4) if field.endswith("Time") else int(self.values[i])
+                for i, field in enumerate(STATS_FIELDS)}
+
+
+def combine_stats(total, stats):
+    # Sums the stats of consecutive planner runs (e.g. offline planning and the online replans); peaks take the max
+    if total is None:
+        return dict(stats)
+    return {field: max(total[field], stats[field]) if field in PEAK_FIELDS else round(total[field] + stats[field], 4)
+            for field in STATS_FIELDS}
+
+
+def stats_row(stats):
+    return [stats[field] if stats is not None else None for field in STATS_FIELDS]
+
+
+####################################################### Memory #################################################################################
+def peak_rss_mb():
+    if resource is None:
+        return 0
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb():
+    # Resident memory of this process now; falls back to the peak where /proc is missing
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * resource.getpagesize() / (1 << 20)
+    except (OSError, AttributeError):
+        return peak_rss_mb()
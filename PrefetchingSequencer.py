@@ -0,0 +1,51 @@
+import math
+import os
+import threading
+
+# Gurobi threads of the background solve; one core is left to the CT search that runs meanwhile
+prefetch_threads = max(1, (os.cpu_count() or 1) - 1)
+
+
+########################################################## Prefetching Sequencer Class #####################################################3
+
+class PrefetchingSequencer:
+    # Wraps a k-best sequencer and eagerly solves for the next allocation in a background thread as soon as the
+    # previous one is taken, so the MILP runs while the CT search expands nodes (Gurobi releases the GIL while
+    # optimizing). The solve runs whether or not the planner ends up needing the allocation; it is not gated by a
+    # bound. Only the background thread touches the solver between a prefetch and the next call to next().
+    def __init__(self, sequencer):
+        self.sequencer = sequencer
+        self.cost_dict = sequencer.cost_dict
+        sequencer.model.setParam("Threads", prefetch_threads)
+        self.thread = None
+        self.result = None
+        self.error = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.thread is None:
+            self.prefetch()
+        self.thread.join()
+        self.thread = None
+
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+        result, self.result = self.result, None
+        if result["Cost"] != math.inf:
+            self.prefetch()
+        return result
+
+    def prefetch(self):
+        # Daemon, so a planner that returns before the solve ends can still exit
+        self.thread = threading.Thread(target=self.solveNext, daemon=True)
+        self.thread.start()
+
+    def solveNext(self):
+        try:
+            self.result = next(self.sequencer)
+        except Exception as e:
+            self.error = e
@@ -0,0 +1,83 @@
+import math
+from bisect import bisect_left
+
+import numpy as np
+
+# Number of standard deviations of the relative drift between two delayed agents covered by a delay window
+windowConfidence = 2
+
+
+def delay_window(delayProb, t):
+    # After t planned moves an agent with delay probability p has been delayed t * p / (1 - p) steps on average,
+    # with variance t * p / (1 - p)^2, so two agents drift apart by sqrt(2 * t * p) / (1 - p) steps (one sd).
+    # One step more covers the neighboring timesteps that the first-step (1-robust) check already guards.
+    return 1 + math.ceil(windowConfidence * math.sqrt(2 * t * delayProb) / (1 - delayProb))
+
+
+########################################################## Reservation Table Class #####################################################3
+
+class ReservationTable:
+    # The other agents' current paths in a node, as the number of agents at every (timestep, cell) and on every
+    # directed move. Without delays a conflict is the same cell at the same timestep or a swap; under delays,
+    # where conflicts come from first-visit times, every cell another agent visits counts, whatever the timestep.
+    # Given a delay probability, a cell counts under delays only when another agent is planned there within
+    # delay_window(t) timesteps of t, since that is where delays can actually make two agents meet.
+    # A table is built for every low-level search, so the timed tables only store the visits themselves (sparse
+    # dicts and per-cell sorted visit times), never an array over all timesteps and cells of the map
+    def __init__(self, num_of_cells, paths, agent, timed=True, delayProb=None):
+        others = [np.asarray(info["path"], dtype=np.int64) for other, info in paths.items()
+                  if other != agent and info["path"]]
+        self.timed = timed
+        self.delayProb = delayProb if not timed else None
+        self.num_of_cells = num_of_cells
+        self.cells = {} if timed or delayProb is not None else np.zeros(num_of_cells, dtype=np.int64)
+        self.moves = {}
+        if not others:
+            return
+
+        if self.delayProb is not None:
+            # Sorted timesteps of the visits to every cell, so a window is two bisections
+            times = np.concatenate([np.arange(len(path)) for path in others])
+            cells = np.concatenate(others)
+            order = np.lexsort((times, cells))
+            times, cells = times[order].tolist(), cells[order]
+            starts = np.flatnonzero(np.concatenate(([True], cells[1:] != cells[:-1]))).tolist()
+            self.cells = {cell: times[start:end]
+                          for cell, start, end in zip(cells[starts].tolist(), starts, starts[1:] + [len(times)])}
+            keys = [np.unique((path[:-1] * num_of_cells + path[1:])[path[:-1] != path[1:]]) for path in others]
+            self.moves = self.countKeys(np.concatenate(keys))
+
+        elif timed:
+            # A visit to cell v at t is stored as one integer, t * cells + v
+            times = np.concatenate([np.arange(len(path)) for path in others])
+            self.cells = self.countKeys(times * num_of_cells + np.concatenate(others))
+            # A move from u (at t - 1) to v (at t) is stored as one integer, (t * cells + u) * cells + v
+            keys = [((np.arange(1, len(path)) * num_of_cells + path[:-1]) * num_of_cells + path[1:])[path[:-1] != path[1:]]
+                    for path in others]
+            self.moves = self.countKeys(np.concatenate(keys))
+        else:
+            # One count per cell of the map, whatever the timestep, which is small enough to keep dense
+            self.cells = np.bincount(np.concatenate([np.unique(path) for path in others]), minlength=num_of_cells)
+            keys = [np.unique((path[:-1] * num_of_cells + path[1:])[path[:-1] != path[1:]]) for path in others]
+            self.moves = self.countKeys(np.concatenate(keys))
+
+    @staticmethod
+    def countKeys(keys):
+        values, counts = np.unique(keys, return_counts=True)
+        return dict(zip(values.tolist(), counts.tolist()))
+
+    def conflicts(self, loc, loc_after_move, t):
+        # Conflicts caused by moving from loc (at t - 1) to loc_after_move (at t)
+        if self.delayProb is not None:
+            window = delay_window(self.delayProb, t)
+            times = self.cells.get(loc_after_move)
+            count = bisect_left(times, t + window + 1) - bisect_left(times, t - window) if times else 0
+            return count + self.moves.get(loc_after_move * self.num_of_cells + loc, 0)
+
+        if not self.timed:
+            return int(self.cells[loc_after_move]) + self.moves.get(loc_after_move * self.num_of_cells + loc, 0)
+
+        count = self.cells.get(t * self.num_of_cells + loc_after_move, 0)
+        if loc != loc_after_move:
+            count += self.moves.get((t * self.num_of_cells + loc_after_move) * self.num_of_cells + loc, 0)
+        return count
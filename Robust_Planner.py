@@ -1,137 +1,504 @@
 import math
+import threading
 import time
-from collections import defaultdict
+from collections import defaultdict, deque
 from queue import PriorityQueue
-from multiprocessing import Process, Queue, Value
+from multiprocessing import Array, Event, Process, Queue, Value
 import ctypes
 
 
+from DelayModel import delay_model
 from FindConflict import FindConflict
 from LowLevelPlan import LowLevelPlan
-from NodeStateClasses import Node
+from NodeStateClasses import DeltaPaths, FocalList, Node
+from PlannerProfiler import SamplingProfiler
+from PlannerStats import STATS_FIELDS, PlannerStats, current_rss_mb, peak_rss_mb
+from PrefetchingSequencer import PrefetchingSequencer
+from SearchTrace import SearchTraceWriter
+from SymmetryReasoning import CorridorReasoning
 from kBestSequencingByMakespan import kBestSequencingByMakespan
 from Verify import Verify
 from kBestSequencingByService import kBestSequencingByService
 from kBestSequencingBySoc import kBestSequencingBySoc
 
+# Optional search enhancements, all off by default so the planner behaves as in the paper
+DEFAULT_PLANNER_OPTIONS = {
+    # Choose cardinal conflicts first, then semi-cardinal, using per-agent MDDs
+    "cardinalConflicts": False,
+    # Order OPEN by g + h, with h from the cardinal conflict graph (minimum vertex cover); admissible, and
+    # therefore only used, when planning without delays under SST or SOC
+    "conflictHeuristic": False,
+    # Adopt a child's path into the parent instead of branching when it has the same cost and fewer conflicts
+    "bypass": False,
+    # Resolve conflicts inside corridors with one pair of range constraints; only used without delays
+    "corridorReasoning": False,
+    # Suboptimality factor w of the focal (ECBS-style) search; 1 keeps the search optimal. Plans cost at most
+    # w times the optimum and carry their proven bound
+    "suboptimality": 1,
+    # Break ties in the low-level A* by conflicts with the other agents' current paths (a reservation table);
+    # costs stay optimal, nodes start with fewer conflicts
+    "reservationTable": False,
+    # Under delays, count a conflict with another agent's visit only within a window that grows with the expected
+    # delay drift; turns the reservation table on when planning with delays
+    "delayWindows": False,
+    # Cap, in stored path cells (about 8 bytes each), of the low-level LRU path cache; 0 turns the cache off.
+    # Not used with focal search or reservation tables, whose paths also depend on the other agents
+    "lowLevelCacheCells": 0,
+    # Build each new root from the paths earlier roots found for the same agent and goal sequence, replanning only
+    # agents whose goal sequence is new
+    "reuseRootPaths": False,
+    # Solve for the next k-best allocation in a background thread while the CT search continues
+    "prefetchAllocations": False,
+    # Most goals each agent may serve, as {agent index: capacity}; agents left out are unlimited
+    "agentCapacities": None,
+    # Time window of each goal, as {goal location: (release, deadline)} in timesteps from the start of the plan; a
+    # goal is served only from its release on, and by its deadline (None for no deadline). SST and MAKESPAN only
+    # bound the MILP by them, SOC checks them in the low-level search alone
+    "goalWindows": None,
+    # File to stream a binary trace of the CT search to (see SearchTrace.py); None turns tracing off
+    "traceFile": None,
+    # Resident memory, in MB, of the planner process past which OPEN is shrunk by memoryPolicy; None for no budget
+    "memoryBudgetMB": None,
+    # "compress" drops the paths of the worst nodes in OPEN and replans them when they are selected, keeping the
+    # search complete; "prune" drops the worst nodes outright (a lossy beam cut: they are never regenerated, so a
+    # plan may be missed) and plans carry the bound that is left
+    "memoryPolicy": "compress",
+    # Children store only their replanned agents' paths and look the others up through their ancestors, instead
+    # of copying every path; the nodes being expanded keep a flat copy while they are in a small cache
+    "deltaPaths": False,
+    # Run the Monte Carlo trials of Verify on SimulationCore, vectorized over trials and agents, for large fleets;
+    # the trials draw from a numpy generator, so results match the default only in distribution
+    "vectorizedVerify": False,
+    # Processes that run the vectorized Verify trials in parallel, each batch with its own seed spawned from one
+    # SeedSequence; above 1 implies vectorizedVerify
+    "verifyWorkers": 0,
+    # Verify with importance sampling: trials delay the conflict-prone agents more and are reweighted, which
+    # bounds small collision probabilities (safe_prob of 0.999 and above) with far fewer trials; runs in-process
+    "importanceSampling": False,
+}
+
+# Pushes to OPEN between two reads of the process memory
+memory_check_interval = 64
+# Expanded nodes whose delta paths are kept flattened
+hot_paths_cache_size = 16
+
 
 class RobustPlanner:
     def __init__(self, AgentLocations, GoalLocations, desired_safe_prob, delaysProb, MapAndDims, verifyAlpha,
-                 gurobiModel, process_queue, typeOfVerify, countExpand, optimize):
+                 gurobiModel, process_queue, typeOfVerify, countExpand, optimize, options=None, stats=None):
+        self.options = {**DEFAULT_PLANNER_OPTIONS, **(options or {})}
+        unknown_options = set(self.options) - set(DEFAULT_PLANNER_OPTIONS)
+        if unknown_options:
+            raise ValueError(f"Unknown planner options: {sorted(unknown_options)}")
+        if self.options["suboptimality"] < 1:
+            raise ValueError(f"suboptimality must be at least 1, got {self.options['suboptimality']}")
+        if self.options["memoryPolicy"] not in ("compress", "prune"):
+            raise ValueError(f"memoryPolicy must be 'compress' or 'prune', got {self.options['memoryPolicy']!r}")
+        self.focalSearch = self.options["suboptimality"] > 1
+        goalWindows = self.options["goalWindows"] or {}
+        if set(goalWindows) - set(GoalLocations):
+            raise ValueError(f"goalWindows has locations that are not goals: {sorted(set(goalWindows) - set(GoalLocations))}")
+
         self.AgentLocations = AgentLocations
         self.desired_safe_prob = desired_safe_prob
-        self.OPEN = PriorityQueue()
+        self.OPEN = FocalList(self.options["suboptimality"]) if self.focalSearch else PriorityQueue()
         self.Num_roots_generated = 0
         self.K_optimal_sequences = {}
+        # Root path (and lower bound) of every (agent, goal sequence) planned so far
+        self.rootPaths = {}
         self.final_sol = None
         self.process_queue = process_queue
+        # A dict of one delay probability per agent, or a DelayModel
+        delaysProb = delay_model(delaysProb)
         self.delaysProb = delaysProb
         self.countExpand = countExpand
+        # Per-phase times and counters; stats is the shared array of a planner process, if any
+        self.stats = PlannerStats(stats)
+        self.pushes = 0
+        # Most full (not compressed) nodes OPEN keeps, set once the memory budget is passed, and the RSS then
+        self.openLimit = None
+        self.limitRss = 0
+        self.compressedInOpen = 0
+        # Smallest f of the nodes dropped by pruning, a lower bound on every plan below them
+        self.prunedBound = math.inf
+        # Delta paths most recently flattened, oldest first
+        self.hotPaths = deque()
         self.optimize = optimize
 
+        agentCapacities = self.options["agentCapacities"]
         if self.optimize == "SST":
-            self.K_Best_Seq_Solver = kBestSequencingByService(self.AgentLocations, GoalLocations, MapAndDims, gurobiModel)
+            self.K_Best_Seq_Solver = kBestSequencingByService(self.AgentLocations, GoalLocations, MapAndDims, gurobiModel,
+                                                              agentCapacities=agentCapacities, goalWindows=goalWindows)
         if self.optimize == "SOC":
-            self.K_Best_Seq_Solver = kBestSequencingBySoc(self.AgentLocations, GoalLocations, MapAndDims, gurobiModel)
+            self.K_Best_Seq_Solver = kBestSequencingBySoc(self.AgentLocations, GoalLocations, MapAndDims, gurobiModel,
+                                                          agentCapacities=agentCapacities)
         if self.optimize == "MAKESPAN":
-            self.K_Best_Seq_Solver = kBestSequencingByMakespan(self.AgentLocations, GoalLocations, MapAndDims, gurobiModel)
-
-        self.LowLevelPlanner = LowLevelPlan(MapAndDims, self.AgentLocations, self.K_Best_Seq_Solver.cost_dict, optimize)
-        self.findConflict_algorithm = FindConflict(delaysProb)
-        self.verify_algorithm = Verify(delaysProb, desired_safe_prob, verifyAlpha, self.process_queue, self.findConflict_algorithm, typeOfVerify)
+            self.K_Best_Seq_Solver = kBestSequencingByMakespan(self.AgentLocations, GoalLocations, MapAndDims, gurobiModel,
+                                                               agentCapacities=agentCapacities, goalWindows=goalWindows)
+        if self.options["prefetchAllocations"]:
+            self.K_Best_Seq_Solver = PrefetchingSequencer(self.K_Best_Seq_Solver)
+
+        useDelayWindows = self.options["delayWindows"] and delaysProb.anyDelays
+        self.LowLevelPlanner = LowLevelPlan(MapAndDims, self.AgentLocations, self.K_Best_Seq_Solver.cost_dict, optimize,
+                                            self.options["suboptimality"], not delaysProb.anyDelays,
+                                            self.options["reservationTable"] or useDelayWindows,
+                                            max(delaysProb.values()) if useDelayWindows else None,
+                                            self.options["lowLevelCacheCells"], goalWindows)
+        self.findConflict_algorithm = FindConflict(delaysProb, self.LowLevelPlanner, self.options["cardinalConflicts"])
+        self.useConflictHeuristic = self.options["conflictHeuristic"] and not delaysProb.anyDelays and \
+            optimize != "MAKESPAN" and not self.focalSearch
+        self.corridorReasoning = None
+        if self.options["corridorReasoning"] and not delaysProb.anyDelays:
+            self.corridorReasoning = CorridorReasoning(MapAndDims, self.AgentLocations)
+        self.verify_algorithm = Verify(delaysProb, desired_safe_prob, verifyAlpha, self.process_queue, self.findConflict_algorithm, typeOfVerify,
+                                       self.options["vectorizedVerify"], self.options["verifyWorkers"],
+                                       self.options["importanceSampling"])
+
+        self.trace = None
+        if self.options["traceFile"]:
+            self.trace = SearchTraceWriter(self.options["traceFile"], {
+                "AgentLocations": self.AgentLocations, "GoalLocations": GoalLocations, "optimize": optimize,
+                "delaysProb": [delaysProb[agent] for agent in range(len(self.AgentLocations))],
+                "Rows": MapAndDims["Rows"], "Cols": MapAndDims["Cols"], "options": self.options})
+
+    def close(self):
+        # Releases the trace file and the Verify worker pool, if any
+        if self.trace is not None:
+            self.trace.close()
+        self.verify_algorithm.close()
+
+    def release(self):
+        # Called from another thread just before the planner process is terminated on timeout, which skips close():
+        # the buffered end of the trace would be lost, and the Verify pool workers and the shared memory of their
+        # plan would outlive the process
+        if self.trace is not None:
+            self.trace.flush()
+        self.verify_algorithm.close()
 
     ####################################################### run ############################################################
 
     def run(self):
         print("New Plan", flush=True)
+        self.CheckMemory()
         # Calculate the best sequence of task allocations (k=1)
-        self.K_optimal_sequences[1] = next(self.K_Best_Seq_Solver)
+        with self.stats.timed("milp"):
+            self.K_optimal_sequences[1] = next(self.K_Best_Seq_Solver)
         if self.K_optimal_sequences[1]['Cost'] == math.inf:
             print(f"Allocation not found", flush=True)
             time.sleep(60)
 
         # Increment root node counter
         self.Num_roots_generated += 1
+        self.stats.set("rootsGenerated", self.Num_roots_generated)
 
-        # Create the root node
-        Root = Node()
-        # Assign the best sequence of task allocations for all agents to the root node
-        Root.sequence = self.K_optimal_sequences[1]
-        # Generate paths and calculate the cost for the root node
-        self.LowLevelPlanner.runLowLevelPlan(Root, list(range(len(self.AgentLocations))))
+        # Create the root node with the best sequence of task allocations for all agents
+        Root = self.GenRoot(self.K_optimal_sequences[1])
 
-        # Add the root node to the open list
-        self.OPEN.put((Root.g, Root))
+        # Add the root node to the open list, or move on to the next allocation if its goal windows cannot be met
+        if Root is not None:
+            if self.trace is not None:
+                self.trace.root(Root, self.Num_roots_generated)
+            self.pushNode(Root)
+        else:
+            self.GenerateNewRoot()
 
         # Continue processing nodes in the open list until it is empty
         while not self.OPEN.empty():
 
-            # Get the node with the lowest cost
-            _, N = self.OPEN.get()
-            # Check if a new root needs to be generated
-            N = self.CheckNewRoot(N)
+            # Get the node with the lowest cost (or, in focal search, the fewest conflicts within the bound)
+            N = self.SelectNode()
             if N is None:
                 continue
+            if N.compressed is not None and not self.RestoreNode(N):
+                continue
+            if isinstance(N.paths, DeltaPaths):
+                self.CachePaths(N)
 
             self.countExpand.value += 1
+            if self.trace is not None:
+                self.trace.expand(N, self.OPEN.qsize())
 
             # If the paths in the current node are verified as valid, avoiding collisions with probability P, return them as the solution
-            if not N.isPositiveNode and self.verify_algorithm.verify(N):
+            if not N.isPositiveNode and self.VerifyNode(N):
                 if self.desired_safe_prob == "NotAvailable":
-                    self.process_queue.put([dict(N.paths), N.g, self.desired_safe_prob])
+                    self.process_queue.put([dict(N.paths), N.g, self.desired_safe_prob, N.bound])
+                if self.trace is not None:
+                    self.trace.flush()
+                self.CheckMemory()
                 return
 
             # Identify the first conflict in the paths
-            conflict = self.findConflict_algorithm.findConflict(N)
+            with self.stats.timed("findConflict"):
+                conflict = self.findConflict_algorithm.findConflict(N)
 
             if conflict is None:
                 continue
             else:
                 _, _, _, x, agent1AndTime, agent2AndTime = conflict
+                if self.trace is not None:
+                    self.trace.conflict(N, x, agent1AndTime, agent2AndTime)
+
+            # A conflict inside a corridor is split once for the whole corridor instead of once per timestep
+            if self.corridorReasoning is not None:
+                corridor = self.corridorReasoning.corridorConstraints(N, x, agent1AndTime[0], agent2AndTime[0])
+                if corridor is not None:
+                    for agent, loc, lastTime in corridor:
+                        A = self.GenRangeChild(N, agent, loc, lastTime)
+                        if A is not None:
+                            self.pushNode(A)
+                    continue
 
             # Generate child nodes with constraints to resolve the conflict and add child nodes to the open list
-            if agent1AndTime[1] != 0:
-                A1 = self.GenChild(N, (agent1AndTime[0], x, agent1AndTime[1]))
-                if A1 is not None:
-                    self.OPEN.put((A1.g, A1))
+            A1 = self.GenChild(N, (agent1AndTime[0], x, agent1AndTime[1])) if agent1AndTime[1] != 0 else None
+            A2 = self.GenChild(N, (agent2AndTime[0], x, agent2AndTime[1])) if agent2AndTime[1] != 0 else None
+
+            if self.options["bypass"] and self.Bypass(N, ((agent1AndTime[0], A1), (agent2AndTime[0], A2))):
+                continue
 
-            if agent2AndTime[1] != 0:
-                A2 = self.GenChild(N, (agent2AndTime[0], x, agent2AndTime[1]))
-                if A2 is not None:
-                    self.OPEN.put((A2.g, A2))
+            if A1 is not None:
+                self.pushNode(A1)
 
-            if self.delaysProb[0] != 0 and max(agent1AndTime[1], agent2AndTime[1]) != 1:
+            if A2 is not None:
+                self.pushNode(A2)
+
+            if self.delaysProb.anyDelays and max(agent1AndTime[1], agent2AndTime[1]) != 1:
                 A3 = self.GenChild(N, (agent1AndTime[0], agent2AndTime[0], x, agent1AndTime[1], agent2AndTime[1]))
-                self.OPEN.put((A3.g, A3))
+                self.pushNode(A3)
 
+        if self.prunedBound < math.inf:
+            # Not a proof that no plan exists: pruned nodes are never regenerated
+            print("Open list exhausted after pruning", flush=True)
         return None
-    ####################################################### Check new root ############################################################
 
-    def CheckNewRoot(self, N):
-        # If the current node cost is within the threshold of the current optimal sequence
-        if N.g <= self.K_optimal_sequences[self.Num_roots_generated]["Cost"]:
+    def pushNode(self, N):
+        if self.focalSearch:
+            with self.stats.timed("findConflict"):
+                N.numOfConflicts = self.findConflict_algorithm.countAllConflicts(N)
+            self.OPEN.put(N, self.NodeLowerBound(N), N.g, (N.numOfConflicts, N.g))
+        else:
+            if self.useConflictHeuristic:
+                with self.stats.timed("findConflict"):
+                    N.h = self.findConflict_algorithm.cardinalConflictHeuristic(N)
+            self.OPEN.put((N.g + N.h, N))
+        self.stats.peak("peakOpen", self.OPEN.qsize())
+
+        self.pushes += 1
+        if self.pushes % memory_check_interval == 0:
+            self.CheckMemory()
+        if self.openLimit is not None and self.OPEN.qsize() - self.compressedInOpen > self.openLimit:
+            self.ShrinkOpen()
+
+    def VerifyNode(self, N):
+        simulations = self.verify_algorithm.simulations
+        with self.stats.timed("verify"):
+            verified = self.verify_algorithm.verify(N)
+        self.stats.set("simulations", self.verify_algorithm.simulations)
+        if self.trace is not None:
+            self.trace.verify(N, verified, self.verify_algorithm.simulations - simulations)
+        return verified
+
+    def ReplanAgents(self, N, agents):
+        with self.stats.timed("lowLevel"):
+            planned = self.LowLevelPlanner.runLowLevelPlan(N, agents)
+        self.stats.set("lowLevelExpanded", self.LowLevelPlanner.expandedStates)
+        return planned
+
+    def NodeLowerBound(self, N):
+        if self.optimize == "MAKESPAN":
+            return max(N.lowerBounds.values(), default=0)
+        return sum(N.lowerBounds.values())
+
+    def SelectNode(self):
+        if not self.focalSearch:
+            _, N = self.OPEN.get()
+            # Check if a new root needs to be generated
+            N = self.CheckNewRoot(N)
+            # Once nodes were pruned, a plan is only proven within its ratio to the best of them
+            if N is not None and N.g + N.h > self.prunedBound:
+                N.bound = N.g / self.prunedBound if self.prunedBound > 0 else 1
             return N
 
-        # Generate a new root with an updated sequence
-        self.Num_roots_generated += 1
-        self.K_optimal_sequences[self.Num_roots_generated] = next(self.K_Best_Seq_Solver)
+        # Roots not generated yet cost at least the current sequence, so once the best lower bound passes it,
+        # the next root has to be in OPEN before the bound is trusted
+        lowerBound = self.OPEN.lowerBound()
+        if lowerBound > self.K_optimal_sequences[self.Num_roots_generated]["Cost"] and self.GenerateNewRoot():
+            return None
+
+        N = self.OPEN.get()
+        lowerBound = min(lowerBound, self.prunedBound)
+        N.bound = N.g / lowerBound if lowerBound > 0 else 1
+        return N
+
+    ####################################################### Memory budget ############################################################
+
+    def CheckMemory(self):
+        self.stats.set("peakRss", peak_rss_mb())
+        budget = self.options["memoryBudgetMB"]
+        if budget is None:
+            return
+
+        # Memory freed by shrinking OPEN is reused but rarely given back to the OS, so the RSS does not drop after
+        # a shrink; the limit is halved again only if the RSS keeps growing past the budget
+        rss = current_rss_mb()
+        if rss <= max(budget, self.limitRss):
+            return
+        self.limitRss = rss
+        fullNodes = self.OPEN.qsize() - self.compressedInOpen
+        self.openLimit = max(1, min(fullNodes, self.openLimit or fullNodes) // 2)
+
+    def ShrinkOpen(self):
+        # Compresses or drops the nodes with the largest f until OPEN holds half its limit of full nodes. Dropped
+        # nodes are gone for good: unlike SMA*, their f is not backed up into a parent that could regenerate them
+        if self.focalSearch:
+            ranked = [(f, self.OPEN.item(count), count) for f, count in self.OPEN.ranked()]
+        else:
+            ranked = [(f, N, None) for f, N in sorted(self.OPEN.queue)]
+        keep = max(1, self.openLimit // 2)
+
+        if self.options["memoryPolicy"] == "compress":
+            fullNodes = 0
+            for _, N, _ in ranked:
+                if N.compressed is None:
+                    fullNodes += 1
+                    if fullNodes > keep:
+                        N.compress()
+                        self.compressedInOpen += 1
+                        self.stats.add("nodesCompressed")
+            return
+
+        dropped = ranked[keep:]
+        self.prunedBound = min(self.prunedBound, dropped[0][0])
+        if self.focalSearch:
+            for _, _, count in dropped:
+                self.OPEN.remove(count)
+        else:
+            # A sorted list is a valid heap
+            self.OPEN.queue[:] = [(f, N) for f, N, _ in ranked[:keep]]
+        self.stats.add("nodesPruned", len(dropped))
+
+    def RestoreNode(self, N):
+        # Replans every agent of a compressed node under its constraints. False if the node has no plan any more,
+        # or if it got costlier (possible with focal search or positive constraints) and went back to OPEN
+        self.compressedInOpen -= 1
+        g = N.g
+        N.restore()
+        N.g = 0
+        if not self.ReplanAgents(N, list(range(len(self.AgentLocations)))):
+            return False
+        if N.g > g:
+            self.pushNode(N)
+            return False
+        return True
+
+    ####################################################### Check new root ############################################################
 
-        if self.K_optimal_sequences[self.Num_roots_generated]["Cost"] == math.inf:
+    def CheckNewRoot(self, N):
+        # If the current node cost (and its lower bound) is within the threshold of the current optimal sequence
+        if N.g + N.h <= self.K_optimal_sequences[self.Num_roots_generated]["Cost"]:
             return N
 
-        # Create a new root node
-        newRoot = Node()
-        newRoot.sequence = self.K_optimal_sequences[self.Num_roots_generated]
-        # Calculate paths and cost for the new root
-        self.LowLevelPlanner.runLowLevelPlan(newRoot, list(range(len(self.AgentLocations))))
+        if not self.GenerateNewRoot():
+            return N
 
-        self.OPEN.put((newRoot.g, newRoot))
-        self.OPEN.put((N.g, N))
+        self.OPEN.put((N.g + N.h, N))
         return None
 
+    def GenerateNewRoot(self):
+        # Generate a new root with an updated sequence, skipping allocations whose goal windows cannot be met
+        while True:
+            self.Num_roots_generated += 1
+            self.stats.set("rootsGenerated", self.Num_roots_generated)
+            with self.stats.timed("milp"):
+                self.K_optimal_sequences[self.Num_roots_generated] = next(self.K_Best_Seq_Solver)
+
+            if self.K_optimal_sequences[self.Num_roots_generated]["Cost"] == math.inf:
+                return False
+
+            # Create a new root node
+            newRoot = self.GenRoot(self.K_optimal_sequences[self.Num_roots_generated])
+
+            if newRoot is not None:
+                if self.trace is not None:
+                    self.trace.root(newRoot, self.Num_roots_generated)
+                self.pushNode(newRoot)
+                return True
+
+    def GenRoot(self, sequence):
+        Root = Node()
+        Root.sequence = sequence
+        agents = list(range(len(self.AgentLocations)))
+
+        if not self.options["reuseRootPaths"]:
+            # Generate paths and calculate the cost for the root node
+            if not self.ReplanAgents(Root, agents):
+                return None
+            return Root
+
+        # Consecutive allocations differ for a few agents only; the others keep the path an earlier root found.
+        # Every agent gets its entry in agent order, so conflicts are searched in the same order as without reuse
+        replan = []
+        for agent in agents:
+            key = (agent, tuple(sequence["Allocations"][agent]))
+            if len(key[1]) > 1 and key in self.rootPaths:
+                path, Root.lowerBounds[agent] = self.rootPaths[key]
+                Root.paths[agent] = {"path": list(path["path"]), "cost": path["cost"]}
+                Root.g = Root.g + path["cost"] if self.optimize != "MAKESPAN" else max(Root.g, path["cost"])
+            else:
+                Root.paths[agent] = {"path": [], "cost": 0}
+                replan.append(agent)
+
+        if not self.ReplanAgents(Root, replan):
+            return None
+
+        for agent in replan:
+            key = (agent, tuple(sequence["Allocations"][agent]))
+            if len(key[1]) > 1 and Root.paths[agent]["path"]:
+                self.rootPaths[key] = ({"path": tuple(Root.paths[agent]["path"]), "cost": Root.paths[agent]["cost"]},
+                                       Root.lowerBounds.get(agent, 0))
+        return Root
+
+    ####################################################### Bypass ############################################################
+
+    def Bypass(self, N, children):
+        # Take over a replanned path of the same cost with fewer conflicts, and put N back instead of branching
+        for agent, A in children:
+            if A is not None and A.paths[agent]["cost"] == N.paths[agent]["cost"] and \
+                    self.CountConflicts(A, agent) < self.CountConflicts(N, agent):
+                N.paths[agent] = A.paths[agent]
+                if self.trace is not None:
+                    self.trace.bypass(N, agent)
+                self.pushNode(N)
+                return True
+        return False
+
+    def CountConflicts(self, N, agent):
+        with self.stats.timed("findConflict"):
+            return self.findConflict_algorithm.countConflicts(N, agent)
+
     ####################################################### Get conflict ############################################################
 
-    def GenChild(self, N, NewCons):
+    def CachePaths(self, N):
+        N.paths.materialize()
+        self.hotPaths.append(N.paths)
+        if len(self.hotPaths) > hot_paths_cache_size:
+            self.hotPaths.popleft().release()
+
+    def CopyNode(self, N, agents):
+        # agents are the ones whose constraints or paths A changes
+        if self.options["deltaPaths"]:
+            A = Node()
+            # The constraint sets of the other agents are shared with N, and never changed in place
+            A.negConstraints = defaultdict(set, N.negConstraints)
+            A.posConstraints = defaultdict(set, N.posConstraints)
+            for agent in agents:
+                A.negConstraints[agent] = set(N.negConstraints.get(agent, ()))
+                A.posConstraints[agent] = set(N.posConstraints.get(agent, ()))
+            A.paths = DeltaPaths(N.paths)
+            A.lowerBounds = dict(N.lowerBounds)
+            A.sequence = N.sequence
+            A.g = N.g
+            return A
+
         A = Node()
         A.negConstraints = defaultdict(set,
                                        {agent: constraints.copy() for agent, constraints in N.negConstraints.items()})
@@ -141,13 +508,18 @@ class RobustPlanner:
             agent: {"path": list(info["path"]), "cost": info["cost"]}
             for agent, info in N.paths.items()
         }
+        A.lowerBounds = dict(N.lowerBounds)
         A.sequence = N.sequence
         A.g = N.g
+        return A
+
+    def GenChild(self, N, NewCons):
+        A = self.CopyNode(N, NewCons[:1] if len(NewCons) == 3 else NewCons[:2])
 
         if len(NewCons) == 3:
             agent, _, _ = NewCons
             A.negConstraints[agent].add(NewCons)
-            if not self.LowLevelPlanner.runLowLevelPlan(A, [agent]):
+            if not self.ReplanAgents(A, [agent]):
                 return None
 
         else:
@@ -156,19 +528,61 @@ class RobustPlanner:
             A.posConstraints[agent1].add(NewCons)
             A.posConstraints[agent2].add(NewCons)
 
+        if self.trace is not None:
+            self.trace.child(A, N, NewCons)
+        return A
+
+    def GenRangeChild(self, N, agent, x, lastTime):
+        # The agent may not be at x at any timestep from 1 to lastTime
+        A = self.CopyNode(N, [agent])
+        A.negConstraints[agent].update((agent, x, t) for t in range(1, lastTime + 1))
+        if not self.ReplanAgents(A, [agent]):
+            return None
+        if self.trace is not None:
+            self.trace.rangeChild(A, N, agent, x, lastTime)
         return A
 
-def planner_process(AgentLocations, GoalLocations, safe_prob, DelaysProbDict, mapAndDim, verifyAlpha, gurobiModel, queue, typeOfVerify, countExpand, optimize):
-    cbss = RobustPlanner(AgentLocations, GoalLocations, safe_prob, DelaysProbDict, mapAndDim, verifyAlpha, gurobiModel, queue, typeOfVerify, countExpand, optimize)
-    cbss.run()
+def release_on_request(flushRequest, flushed, profiler, planners):
+    # Thread of the planner process, since the main thread may be inside the solver. The parent sets flushRequest
+    # before it terminates the process on timeout; the profile is written and the planner releases what would
+    # outlive the process
+    flushRequest.wait()
+    if profiler is not None:
+        profiler.flush()
+    for cbss in planners:
+        cbss.release()
+    flushed.set()
+
+
+def planner_process(AgentLocations, GoalLocations, safe_prob, DelaysProbDict, mapAndDim, verifyAlpha, gurobiModel, queue, typeOfVerify, countExpand, optimize, options=None, stats=None, profile_file=None, flushRequest=None, flushed=None):
+    profiler = SamplingProfiler(profile_file) if profile_file else None
+    # The planner, once created, for the release thread
+    planners = []
+    if flushRequest is not None:
+        threading.Thread(target=release_on_request, args=(flushRequest, flushed, profiler, planners), daemon=True).start()
+    if profiler is not None:
+        profiler.start()
+    try:
+        cbss = RobustPlanner(AgentLocations, GoalLocations, safe_prob, DelaysProbDict, mapAndDim, verifyAlpha, gurobiModel, queue, typeOfVerify, countExpand, optimize, options, stats)
+        planners.append(cbss)
+        try:
+            cbss.run()
+        finally:
+            cbss.close()
+    finally:
+        if profiler is not None:
+            profiler.stop()
 
 def run_robust_planner_with_timeout(AgentLocations, GoalLocations, safe_prob, DelaysProbDict, mapAndDim,
-                                    verifyAlpha, gurobiModel, max_planning_time, typeOfVerify, optimize):
+                                    verifyAlpha, gurobiModel, max_planning_time, typeOfVerify, optimize, options=None,
+                                    profile_file=None):
     queue = Queue()
     countExpand = Value(ctypes.c_long, 0)
+    stats = Array(ctypes.c_double, len(STATS_FIELDS), lock=False)
+    flushRequest, flushed = Event(), Event()
     process = Process(
         target=planner_process,
-        args=(AgentLocations, GoalLocations, safe_prob, DelaysProbDict, mapAndDim, verifyAlpha, gurobiModel, queue, typeOfVerify, countExpand, optimize)
+        args=(AgentLocations, GoalLocations, safe_prob, DelaysProbDict, mapAndDim, verifyAlpha, gurobiModel, queue, typeOfVerify, countExpand, optimize, options, stats, profile_file, flushRequest, flushed)
     )
     start_time = time.time()
     process.start()
@@ -177,6 +591,9 @@ def run_robust_planner_with_timeout(AgentLocations, GoalLocations, safe_prob, De
 
     if process.is_alive():
         print("Planning Timeout reached.")
+        # Let the planner process write its profile and release its Verify pool before it is terminated
+        flushRequest.set()
+        flushed.wait(timeout=5)
         process.terminate()
         process.join()
 
@@ -184,4 +601,4 @@ def run_robust_planner_with_timeout(AgentLocations, GoalLocations, safe_prob, De
     while not queue.empty():
         last_result = queue.get_nowait()
     expansions = countExpand.value
-    return last_result, min(60, plan_time), expansions
+    return last_result, min(60, plan_time), expansions, PlannerStats(stats).asDict()
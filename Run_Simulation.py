@@ -1,61 +1,68 @@
+import numpy as np
+
+from DelayModel import delay_model
+
+
 class Run_Simulation:
 
     def __init__(self, plan, delaysProb, AgentLocations, GoalLocations, randGen, timestep, TST):
         self.plan = plan
-        self.delaysProb = delaysProb
+        self.delaysProb = delay_model(delaysProb)
         self.AgentLocations = AgentLocations
         self.remainGoals = GoalLocations
         self.randGen = randGen
         self.TST = TST
         self.timestep = timestep
 
+        # Paths as one array, each row padded with the agent's last location, and a progress index per agent
+        self.agents = list(plan.keys())
+        pathLengths = [len(plan[agent]["path"]) for agent in self.agents]
+        self.paths = np.empty((len(self.agents), max(pathLengths, default=1)), dtype=np.int64)
+        for row, agent in enumerate(self.agents):
+            path = plan[agent]["path"]
+            self.paths[row, :len(path)] = path
+            self.paths[row, len(path):] = path[-1]
+
+        self.lastIndex = np.array(pathLengths, dtype=np.int64) - 1
+        self.progress = np.zeros(len(self.agents), dtype=np.int64)
+        self.agentMove = self.delaysProb.agentMoveProbs(self.agents)
+        self.agentDelays = 1 - self.agentMove
+        self.rows = np.arange(len(self.agents))
+
     def Check_Potential_Conflict_With_Delay(self):
-        potential_locs = []
-
-        for currAgent, path in self.plan.items():
-            currLoc = path["path"][0]
-            for agent, loc in potential_locs:
-                if currLoc == loc and currAgent != agent:
-                    return False
-            potential_locs.append((currAgent, currLoc))
-
-            if len(path["path"]) > 1:
-                nextLoc = path["path"][1]
-                for agent, loc in potential_locs:
-                    if nextLoc == loc and currAgent != agent:
-                        return False
-                potential_locs.append((currAgent, nextLoc))
+        # Every agent claims its current cell and, if it still moves, its next cell; a cell claimed by two agents is a conflict
+        currLocs = self.paths[self.rows, self.progress]
+        nextLocs = self.paths[self.rows, np.minimum(self.progress + 1, self.lastIndex)]
+        claimedLocs = np.concatenate((currLocs, nextLocs[nextLocs != currLocs]))
 
-        return True
+        # Sorting the claimed cells costs the same on any map, where counts per cell grow with the map size
+        claimedLocs.sort()
+        return not (claimedLocs[1:] == claimedLocs[:-1]).any()
 
     def runSimulation(self):
-        # Initialize the set of active agents (agents that have not finished their path)
-        active_agents = {agent for agent, path in self.plan.items() if len(path["path"]) > 1}
+        # Agents that have not finished their path
+        active = self.progress < self.lastIndex
 
-        while active_agents:
-            if self.delaysProb[0] != 0 and not self.Check_Potential_Conflict_With_Delay():
+        while active.any():
+            if self.delaysProb.anyDelays and not self.Check_Potential_Conflict_With_Delay():
                 return False
 
+            # Delay probabilities of the agents in their current cells at this timestep
+            delays = self.agentDelays
+            if self.delaysProb.varying:
+                delays = 1 - self.delaysProb.moveProbs(self.agentMove, self.paths[self.rows, self.progress], self.timestep)
             self.timestep += 1
-            new_locs = []
-            # Set to track agents that have completed their paths
-            finish_agents = set()
-
-            for agent, path in self.plan.items():
-                # Simulate agent movement with a delay probability
-                if len(path["path"]) != 1 and self.randGen.random() > self.delaysProb[agent]:
-                    # Remove the first step if the agent moves
-                    path["path"].pop(0)
-
-                new_locs.append(path["path"][0])
 
-                # If the agent has reached its destination, mark it for removal
-                if len(path["path"]) == 1:
-                    finish_agents.add(agent)
+            # Simulate agent movement with a delay probability, one draw per active agent in agent order
+            activeRows = np.flatnonzero(active)
+            draws = np.array([self.randGen.random() for _ in range(len(activeRows))], dtype=np.float64)
+            self.progress[activeRows[draws > delays[activeRows]]] += 1
 
-            active_agents -= finish_agents
+            active = self.progress < self.lastIndex
+            new_locs = self.paths[self.rows, self.progress].tolist()
             self.AgentLocations = new_locs
 
+            # Goal bookkeeping keeps the set difference so the remaining goals keep the order the replanner expects
             remainGoalsBeforeStep = len(self.remainGoals)
             self.remainGoals = list(set(self.remainGoals) - set(new_locs))
             self.TST += self.timestep * (remainGoalsBeforeStep - len(self.remainGoals))
@@ -1,10 +1,11 @@
 import os
 import csv
-import ast
 import sys
 from multiprocessing import Process, Queue, Value
 import gurobipy as gp
 import ctypes
+from InstanceStore import read_locs
+from MapLoader import load_map
 from kBestSequencingByService import kBestSequencingByService
 
 
@@ -26,28 +27,9 @@ gurobiModel.setParam("IntFeasTol", 1e-9)
 gurobiModel.setParam("Seed", 42)
 
 
-####################################################### Create Map #################################################################################
-def create_map(map_name):
-    file_path = f"OurResearch.domain/{map_name}.map"
-    with open(file_path, "r") as file:
-        lines = file.readlines()
-    map_start_index = lines.index("map\n") + 1
-    map_lines = lines[map_start_index:]
-
-    currMap = []
-    rows, cols = 0, 0
-    for line in map_lines:
-        cols = len(line.strip())
-        rows += 1
-        for char in line.strip():
-            currMap += [0] if char == "." else [1]
-
-    return {"Rows": rows, "Cols": cols, "Map": currMap}
-
-
 ####################################################### Global Variables ######################################################################
 mapName = sys.argv[1]
-mapAndDim = create_map(mapName)
+mapAndDim = load_map(mapName)
 num_of_agents = int(sys.argv[2])
 num_of_goals = int(sys.argv[3])
 configStr = f"{mapName}_num_of_agents_{num_of_agents}num_of_goals{num_of_goals}"
@@ -67,16 +49,7 @@ with open(f"Scalability_Milp_Test_files/Output_{configStr}.csv", mode="w", newli
 
 ####################################################### Read locs from file #################################################################################
 def read_locs_from_file(num_of_instance):
-    file_agents_name = f"Agent_Goal_locations_files/{mapName.split('.')[0]}_Map_Agent_Locs_instance_{num_of_instance - 1}.txt"
-    file_goals_name = f"Agent_Goal_locations_files/{mapName.split('.')[0]}_Map_Goal_Locs_instance_{num_of_instance - 1}.txt"
-
-    with open(file_agents_name, "r") as f:
-        Agents_Positions = [ast.literal_eval(line.strip()) for _, line in zip(range(num_of_agents), f)]
-
-    with open(file_goals_name, "r") as f:
-        Goals_Locations = [ast.literal_eval(line.strip()) for _, line in zip(range(num_of_goals), f)]
-
-    return Agents_Positions, Goals_Locations
+    return read_locs(mapName, num_of_instance, num_of_agents, num_of_goals)
 
 
 ####################################################### run Test  #################################################################################
@@ -0,0 +1,266 @@
+import argparse
+import json
+import struct
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+trace_magic = b"CTTR"
+trace_version = 1
+
+# One record per event, each starting with a one-byte tag. Locations are cells; an edge is two cells and a vertex
+# has -1 as its second cell. Node ids are given in creation order, starting from 1
+ROOT = struct.Struct("<cIIiI")              # tag, node, root index, g, length of the JSON allocation that follows
+EXPAND = struct.Struct("<cIiI")             # tag, node, g, OPEN size
+CONFLICT = struct.Struct("<cIHIHIii")       # tag, node, agent1, time1, agent2, time2, cell1, cell2
+CHILD = struct.Struct("<cIIiHIii")          # tag, node, parent, g, agent, time, cell1, cell2
+POSITIVE_CHILD = struct.Struct("<cIIHHIIii")  # tag, node, parent, agent1, agent2, time1, time2, cell1, cell2
+RANGE_CHILD = struct.Struct("<cIIiHIi")     # tag, node, parent, g, agent, last time, cell
+BYPASS = struct.Struct("<cIHi")             # tag, node, agent, g after the bypass
+VERIFY = struct.Struct("<cIBI")             # tag, node, verified, simulations run
+HEADER = struct.Struct("<4sBI")             # magic, version, length of the JSON instance that follows
+
+RECORDS = {b"R": ROOT, b"E": EXPAND, b"X": CONFLICT, b"C": CHILD, b"P": POSITIVE_CHILD, b"W": RANGE_CHILD,
+           b"B": BYPASS, b"V": VERIFY}
+
+
+def cells(x):
+    if isinstance(x, frozenset):
+        loc1, loc2 = sorted(x)
+        return loc1, loc2
+    return x, -1
+
+
+def location(loc1, loc2):
+    return loc1 if loc2 == -1 else frozenset((loc1, loc2))
+
+
+########################################################## Search Trace Writer Class #####################################################3
+
+class SearchTraceWriter:
+    # Packs fixed-size records into one preallocated buffer that is written out when full, after a root, and on the
+    # first expand or verify more than a second after the last write. On timeout the planner process flushes it from
+    # another thread before it is terminated, so the trace ends where the search stopped
+    def __init__(self, file_path, instance, bufferSize=1 << 16):
+        self.file = open(file_path, "wb")
+        self.buffer = bytearray(bufferSize)
+        self.offset = 0
+        self.maxRecordSize = max(record.size for record in RECORDS.values())
+        self.lastFlush = time.monotonic()
+        self.nodeCounter = 0
+        # flush() may come from another thread while the planner is still writing records
+        self.lock = threading.Lock()
+
+        encoded = json.dumps(instance).encode()
+        self.file.write(HEADER.pack(trace_magic, trace_version, len(encoded)) + encoded)
+
+    def newNode(self, N):
+        self.nodeCounter += 1
+        N.traceId = self.nodeCounter
+
+    def pack(self, record, *values):
+        with self.lock:
+            if self.offset + self.maxRecordSize > len(self.buffer):
+                self.writeBuffer()
+            record.pack_into(self.buffer, self.offset, *values)
+            self.offset += record.size
+
+    def flush(self):
+        with self.lock:
+            if not self.file.closed:
+                self.writeBuffer()
+
+    def flushIfDue(self):
+        if time.monotonic() - self.lastFlush > 1:
+            self.flush()
+
+    def writeBuffer(self):
+        self.file.write(memoryview(self.buffer)[:self.offset])
+        self.file.flush()
+        self.offset = 0
+        self.lastFlush = time.monotonic()
+
+    def root(self, N, rootIndex):
+        self.newNode(N)
+        allocation = json.dumps({str(agent): seq for agent, seq in N.sequence["Allocations"].items()}).encode()
+        self.pack(ROOT, b"R", N.traceId, rootIndex, N.g, len(allocation))
+        with self.lock:
+            self.writeBuffer()
+            self.file.write(allocation)
+            self.file.flush()
+
+    def expand(self, N, openSize):
+        self.pack(EXPAND, b"E", N.traceId, N.g, openSize)
+        self.flushIfDue()
+
+    def conflict(self, N, x, agent1AndTime, agent2AndTime):
+        self.pack(CONFLICT, b"X", N.traceId, agent1AndTime[0], agent1AndTime[1], agent2AndTime[0],
+                  agent2AndTime[1], *cells(x))
+
+    def child(self, A, N, NewCons):
+        self.newNode(A)
+        if len(NewCons) == 3:
+            agent, x, t = NewCons
+            self.pack(CHILD, b"C", A.traceId, N.traceId, A.g, agent, t, *cells(x))
+        else:
+            agent1, agent2, x, t1, t2 = NewCons
+            self.pack(POSITIVE_CHILD, b"P", A.traceId, N.traceId, agent1, agent2, t1, t2, *cells(x))
+
+    def rangeChild(self, A, N, agent, x, lastTime):
+        self.newNode(A)
+        self.pack(RANGE_CHILD, b"W", A.traceId, N.traceId, A.g, agent, lastTime, x)
+
+    def bypass(self, N, agent):
+        self.pack(BYPASS, b"B", N.traceId, agent, N.g)
+
+    def verify(self, N, verified, simulations):
+        self.pack(VERIFY, b"V", N.traceId, verified, simulations)
+        self.flushIfDue()
+
+    def close(self):
+        with self.lock:
+            self.writeBuffer()
+            self.file.close()
+
+
+####################################################### Read #################################################################################
+def read_trace(file_path):
+    # Returns the instance and a list of (tag, values) records; a trace cut off mid-record ends at the last whole one
+    with open(file_path, "rb") as file:
+        data = file.read()
+
+    magic, version, length = HEADER.unpack_from(data, 0)
+    if magic != trace_magic or version != trace_version:
+        raise ValueError(f"{file_path} is not a version {trace_version} search trace")
+    offset = HEADER.size + length
+    instance = json.loads(data[HEADER.size:offset])
+
+    records = []
+    while offset < len(data):
+        record = RECORDS[data[offset:offset + 1]]
+        if offset + record.size > len(data):
+            break
+        values = record.unpack_from(data, offset)
+        offset += record.size
+
+        if values[0] == b"R":
+            # The allocation of a root follows its record
+            if offset + values[4] > len(data):
+                break
+            allocation = json.loads(data[offset:offset + values[4]])
+            offset += values[4]
+            values = values[:4] + ({int(agent): seq for agent, seq in allocation.items()},)
+        records.append((values[0].decode(), values[1:]))
+    return instance, records
+
+
+####################################################### Statistics #################################################################################
+def trace_statistics(records):
+    counts = Counter(tag for tag, _ in records)
+    depth = {}
+    conflictPairs = Counter()
+    verified = Counter()
+    simulations = 0
+    solution = None
+
+    for tag, values in records:
+        if tag == "R":
+            depth[values[0]] = 0
+        elif tag in ("C", "P", "W"):
+            depth[values[0]] = depth.get(values[1], 0) + 1
+        elif tag == "X":
+            conflictPairs[tuple(sorted((values[1], values[3])))] += 1
+        elif tag == "V":
+            verified[bool(values[1])] += 1
+            simulations += values[2]
+            if values[1]:
+                solution = values[0]
+
+    expandedDepths = [depth.get(values[0], 0) for tag, values in records if tag == "E"]
+    return {"roots": counts["R"], "expansions": counts["E"], "conflicts": counts["X"],
+            "children": counts["C"], "positiveChildren": counts["P"], "rangeChildren": counts["W"],
+            "bypasses": counts["B"], "verifyPassed": verified[True], "verifyFailed": verified[False],
+            "simulations": simulations, "maxExpandedDepth": max(expandedDepths, default=0),
+            "solutionNode": solution,
+            "topConflictPairs": [[list(pair), count] for pair, count in conflictPairs.most_common(5)]}
+
+
+####################################################### Replay #################################################################################
+def replay_low_level(instance, records, mapAndDim):
+    # Rebuilds every node from its root allocation and the constraints along its branch, reruns the low-level search
+    # for the constrained agent and checks the cost against the trace; the MILP is not needed. Costs only match
+    # traces of optimal searches (suboptimality 1)
+    from LowLevelPlan import LowLevelPlan
+    from MapLoader import precompute_costs
+    from NodeStateClasses import Node
+
+    if (mapAndDim["Rows"], mapAndDim["Cols"]) != (instance["Rows"], instance["Cols"]):
+        raise ValueError("The map does not have the dimensions of the traced instance")
+
+    AgentLocations = instance["AgentLocations"]
+    cost_dict = precompute_costs(mapAndDim, instance["GoalLocations"])
+    goalWindows = {int(goal): tuple(window) for goal, window in (instance["options"]["goalWindows"] or {}).items()}
+    planner = LowLevelPlan(mapAndDim, AgentLocations, cost_dict, instance["optimize"], goalWindows=goalWindows)
+
+    nodes = {}
+    mismatches = []
+    calls = 0
+    for tag, values in records:
+        if tag == "R":
+            N = Node()
+            N.sequence = {"Allocations": values[3]}
+            calls += 1
+            planner.runLowLevelPlan(N, list(range(len(AgentLocations))))
+            nodes[values[0]] = N
+        elif tag in ("C", "W") and values[1] in nodes:
+            parent = nodes[values[1]]
+            A = Node()
+            A.sequence = parent.sequence
+            A.paths = {agent: dict(info) for agent, info in parent.paths.items()}
+            A.negConstraints = defaultdict(set, {a: set(cons) for a, cons in parent.negConstraints.items()})
+            A.posConstraints = defaultdict(set, {a: set(cons) for a, cons in parent.posConstraints.items()})
+            A.g = parent.g
+            if tag == "C":
+                _, _, g, agent, t, loc1, loc2 = values
+                A.negConstraints[agent].add((agent, location(loc1, loc2), t))
+            else:
+                _, _, g, agent, lastTime, loc = values
+                A.negConstraints[agent].update((agent, loc, t) for t in range(1, lastTime + 1))
+            calls += 1
+            if not planner.runLowLevelPlan(A, [agent]) or A.g != g:
+                mismatches.append(values[0])
+            nodes[values[0]] = A
+        elif tag == "P" and values[1] in nodes:
+            parent = nodes[values[1]]
+            _, _, agent1, agent2, t1, t2, loc1, loc2 = values
+            A = Node()
+            A.sequence, A.paths, A.g = parent.sequence, parent.paths, parent.g
+            A.negConstraints = parent.negConstraints
+            A.posConstraints = defaultdict(set, {a: set(cons) for a, cons in parent.posConstraints.items()})
+            NewCons = (agent1, agent2, location(loc1, loc2), t1, t2)
+            A.posConstraints[agent1].add(NewCons)
+            A.posConstraints[agent2].add(NewCons)
+            nodes[values[0]] = A
+
+    return {"lowLevelCalls": calls, "mismatches": mismatches}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Summarize or replay a CT search trace (traceFile planner option).")
+    parser.add_argument("trace")
+    parser.add_argument("--replay-map", default=None, help="Map name; reruns the traced low-level calls on it")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    instance, records = read_trace(args.trace)
+    result = trace_statistics(records)
+
+    if args.replay_map:
+        from MapLoader import load_map
+        result["replay"] = replay_low_level(instance, records, load_map(args.replay_map))
+
+    json.dump(result, sys.stdout, indent=1)
+    print()
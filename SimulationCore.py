@@ -0,0 +1,283 @@
+import os
+from multiprocessing import Pool, resource_tracker, shared_memory
+
+import numpy as np
+
+from DelayModel import delay_model
+
+# Most agents times trials simulated at once; bounds the memory of a chunk to some tens of MB
+chunk_agent_trials = 1 << 18
+# Trials of one pool task; every batch has its own seed, so the outcomes do not depend on the number of workers
+parallel_batch_size = 256
+# Importance sampling: share of trials drawn from the plain delay model (this bounds every weight by its inverse),
+# and the delay probability of the one conflict-prone agent every other trial delays more
+importance_nominal_share = 0.5
+importance_delay_prob = 0.5
+
+
+def plan_arrays(plan, delaysProb):
+    # Paths as one array, each row padded with the agent's last location, with the last index of every path and
+    # the probability that the agent moves at a timestep (the agent's own part of the delay model)
+    agents = list(plan.keys())
+    pathLengths = [len(plan[agent]["path"]) for agent in agents]
+    paths = np.empty((len(agents), max(pathLengths, default=1)), dtype=np.int64)
+    for row, agent in enumerate(agents):
+        path = plan[agent]["path"]
+        paths[row, :len(path)] = path
+        paths[row, len(path):] = path[-1]
+
+    lastIndex = np.array(pathLengths, dtype=np.int64) - 1
+    moveProb = delay_model(delaysProb).agentMoveProbs(agents)
+    return paths, lastIndex, moveProb
+
+
+########################################################## Simulation Core Class #####################################################3
+
+class SimulationCore:
+    # Monte Carlo trials of a plan under delays, vectorized over trials and agents. At every timestep each agent that
+    # has not reached the end of its path moves on with probability 1 - its delay probability (DelayModel, which may
+    # depend on the agent's cell and the timestep), and a trial fails
+    # when two agents are in one cell, or swap cells, after the step: the collision model of
+    # Verify.run_s_simulations. Collisions are found by sorting (trial, cell) and (trial, edge) ids of the agents at
+    # risk only: those in a cell some other agent's path visits, or on an edge some path takes the other way. The
+    # rest of a timestep is linear in the agents times trials of the chunk, whatever the size of the map
+    def __init__(self, plan, delaysProb, rng, chunkSize=None, arrays=None):
+        # arrays, from plan_arrays, stand in for the plan in pool workers, where delaysProb is None unless the delay
+        # model varies by cell or timestep
+        self.plan = plan
+        self.rng = rng
+        self.paths, self.lastIndex, self.moveProb = arrays if arrays is not None else plan_arrays(plan, delaysProb)
+        delayModel = delay_model(delaysProb) if delaysProb is not None else None
+        # The delay model, when the move probabilities are drawn again at every timestep
+        self.varyingDelays = delayModel if delayModel is not None and delayModel.varying else None
+        self.rows = np.arange(len(self.paths))
+        self.numOfCells = int(self.paths.max(initial=0)) + 1
+
+        # Cells visited by two agents or more
+        visits = np.unique(self.rows[:, None] * self.numOfCells + self.paths) % self.numOfCells
+        self.vertexRisk = (np.bincount(visits, minlength=self.numOfCells) > 1)[self.paths]
+        # Steps onto index i of a path along an edge that some path (possibly the agent's own, which is harmless)
+        # also takes the other way
+        edges = self.paths[:, :-1] * self.numOfCells + self.paths[:, 1:]
+        reversedEdges = self.paths[:, 1:] * self.numOfCells + self.paths[:, :-1]
+        moving = self.paths[:, :-1] != self.paths[:, 1:]
+        self.swapRisk = np.zeros(self.paths.shape, dtype=bool)
+        self.swapRisk[:, 1:] = moving & np.isin(edges, reversedEdges[moving])
+
+        # Conflict-prone agents, which importance sampling delays more, with the index of their last risky step:
+        # delays past it cannot bring the agent into a collision any more. Agents that are never delayed are left
+        # out, since no trial of the plain model delays them
+        risky = self.vertexRisk | self.swapRisk
+        self.riskEnd = np.where(risky.any(axis=1), risky.shape[1] - 1 - np.argmax(risky[:, ::-1], axis=1), 0)
+        maxDelayProb = 1 - self.moveProb if self.varyingDelays is None else self.varyingDelays.maxDelayProbs(self.moveProb)
+        self.riskAgents = np.flatnonzero((self.riskEnd > 0) & (maxDelayProb > 0))
+
+        if chunkSize is None:
+            chunkSize = chunk_agent_trials // max(1, len(self.rows))
+        # Edge ids of a chunk are below trials * cells^2, which has to fit in an int64
+        self.chunkSize = max(1, min(chunkSize, (1 << 62) // self.numOfCells ** 2))
+
+    def run(self, trials):
+        return int(self.outcomes(trials).sum())
+
+    def outcomes(self, trials):
+        # True for every trial without a collision, in the order the trials were drawn
+        return np.concatenate([self.runChunk(min(self.chunkSize, trials - start))[0]
+                               for start in range(0, trials, self.chunkSize)] or [np.zeros(0, dtype=bool)])
+
+    def weightedOutcomes(self, trials):
+        # Importance sampling: the outcome of every trial and its likelihood ratio (plain model over the proposal),
+        # so that the mean of weight * (1 - success) is an unbiased estimate of the collision probability
+        chunks = [self.runChunk(min(self.chunkSize, trials - start), True) for start in range(0, trials, self.chunkSize)]
+        return (np.concatenate([success for success, _ in chunks] or [np.zeros(0, dtype=bool)]),
+                np.concatenate([weights for _, weights in chunks] or [np.zeros(0)]))
+
+    def runChunk(self, trials, importance=False):
+        success = np.zeros(trials, dtype=bool)
+        weights = np.ones(trials) if importance else None
+        # Trials still running, by index into success
+        running = np.arange(trials)
+        progress = np.zeros((trials, len(self.rows)), dtype=np.int64)
+        locs = np.broadcast_to(self.paths[:, 0], progress.shape)
+
+        importance = importance and len(self.riskAgents) > 0
+        if importance:
+            # The proposal is a mixture: a trial draws from the plain model, or delays one conflict-prone agent
+            # (index into riskAgents) with a higher probability up to its last risky step
+            target = np.where(self.rng.random(trials) < importance_nominal_share, -1,
+                              self.rng.integers(len(self.riskAgents), size=trials))
+            # Log likelihood ratio of every component of the mixture over the plain model, from the draws of its
+            # conflict-prone agent before its last risky step
+            logRatios = np.zeros((trials, len(self.riskAgents)))
+
+        t = 0
+        while True:
+            active = progress < self.lastIndex
+            ongoing = active.any(axis=1)
+            if importance and not ongoing.all():
+                weights[running[~ongoing]] = self.likelihoodRatio(logRatios[~ongoing])
+            success[running[~ongoing]] = True
+            if not ongoing.all():
+                running, progress, locs, active = running[ongoing], progress[ongoing], locs[ongoing], active[ongoing]
+                if importance:
+                    target, logRatios = target[ongoing], logRatios[ongoing]
+            if len(running) == 0:
+                return success, weights
+
+            moveProb = self.moveProb if self.varyingDelays is None else self.varyingDelays.moveProbs(self.moveProb, locs, t)
+            t += 1
+            if importance:
+                riskProgress = progress[:, self.riskAgents]
+                inWindow = active[:, self.riskAgents] & (riskProgress < self.riskEnd[self.riskAgents])
+                # Delay probability of the conflict-prone agents at this timestep, and the higher one their
+                # component of the mixture delays them with (never where the plain model cannot delay them)
+                riskDelay = 1 - np.broadcast_to(moveProb, progress.shape)[:, self.riskAgents]
+                biasedDelay = np.where(riskDelay > 0, np.maximum(importance_delay_prob, riskDelay), 0)
+                biased = np.flatnonzero(target >= 0)
+                biased = biased[inWindow[biased, target[biased]]]
+                if len(biased):
+                    moveProb = np.array(np.broadcast_to(moveProb, progress.shape))
+                    moveProb[biased, self.riskAgents[target[biased]]] = 1 - biasedDelay[biased, target[biased]]
+
+            moves = active & (self.rng.random(progress.shape) < moveProb)
+            if importance:
+                riskMoves = moves[:, self.riskAgents]
+                # Draws the plain model cannot make are never made by the proposal, so the undefined ratios are
+                # never picked
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    stepRatios = np.where(riskMoves, np.log((1 - biasedDelay) / (1 - riskDelay)),
+                                          np.log(biasedDelay / riskDelay))
+                logRatios += np.where(inWindow, stepRatios, 0)
+            progress += moves
+            newLocs = self.paths[self.rows, progress]
+
+            collided = self.vertexCollisions(newLocs, self.vertexRisk[self.rows, progress]) | \
+                self.swapCollisions(locs, newLocs, moves & self.swapRisk[self.rows, progress])
+            if collided.any():
+                if importance:
+                    weights[running[collided]] = self.likelihoodRatio(logRatios[collided])
+                    target, logRatios = target[~collided], logRatios[~collided]
+                running, progress, newLocs = running[~collided], progress[~collided], newLocs[~collided]
+            locs = newLocs
+
+    def likelihoodRatio(self, logRatios):
+        # Plain model over the mixture proposal; at most 1 / importance_nominal_share
+        with np.errstate(over="ignore"):
+            meanRatio = np.exp(np.logaddexp.reduce(logRatios, axis=1) - np.log(len(self.riskAgents)))
+        return 1 / (importance_nominal_share + (1 - importance_nominal_share) * meanRatio)
+
+    def vertexCollisions(self, locs, atRisk):
+        collided = np.zeros(len(locs), dtype=bool)
+        trial, row = np.nonzero(atRisk)
+        if len(trial) < 2:
+            return collided
+
+        keys = trial * self.numOfCells + locs[trial, row]
+        keys.sort()
+        collided[keys[1:][keys[1:] == keys[:-1]] // self.numOfCells] = True
+        return collided
+
+    def swapCollisions(self, locs, newLocs, atRisk):
+        # Two agents swap when one moves along an edge the other moves along the other way, in the same trial
+        collided = np.zeros(len(locs), dtype=bool)
+        trial, row = np.nonzero(atRisk)
+        if len(trial) < 2:
+            return collided
+
+        fromLocs, toLocs = locs[trial, row], newLocs[trial, row]
+        trialBase = trial * self.numOfCells
+        edges = (trialBase + fromLocs) * self.numOfCells + toLocs
+        reversedEdges = (trialBase + toLocs) * self.numOfCells + fromLocs
+        collided[trial[np.isin(edges, reversedEdges)]] = True
+        return collided
+
+
+########################################################## Parallel Trials Class #####################################################3
+
+class ParallelTrials:
+    # Runs the trials of SimulationCore on a process pool. The arrays of a plan go to shared memory once, and every
+    # batch of parallel_batch_size trials draws from its own generator, spawned from the base seed by (plan index,
+    # batch index): the outcomes come back in batch order, the same for any number of workers
+    def __init__(self, workers, seed):
+        self.workers = workers
+        # Workers started before the resource tracker would each start their own, which then reports the plans
+        # they attached to as leaked when they exit
+        if os.name == "posix":
+            resource_tracker.ensure_running()
+        self.pool = Pool(workers)
+        self.seed = np.random.SeedSequence(seed)
+        self.plan = None
+        self.delaysProb = None
+        self.block = None
+        self.shape = None
+        # Sent with every task when the delay model varies by cell or timestep; the move probabilities of the
+        # agents alone are in shared memory
+        self.varyingDelays = None
+        self.planIndex = 0
+        self.batchIndex = 0
+
+    def setPlan(self, plan, delaysProb):
+        self.release()
+        arrays = plan_arrays(plan, delaysProb)
+        delayModel = delay_model(delaysProb)
+        self.varyingDelays = delayModel if delayModel.varying else None
+        self.shape = arrays[0].shape
+        self.block = shared_memory.SharedMemory(create=True, size=sum(array.nbytes for array in arrays))
+        offset = 0
+        for array in arrays:
+            np.ndarray(array.shape, array.dtype, self.block.buf, offset)[...] = array
+            offset += array.nbytes
+
+        self.plan = plan
+        self.delaysProb = delaysProb
+        self.planIndex += 1
+        self.batchIndex = 0
+
+    def outcomes(self, trials):
+        if self.pool is None:
+            # Closed from another thread while a verify was still running (the planner is about to be terminated)
+            return SimulationCore(self.plan, self.delaysProb, np.random.default_rng(self.seed)).outcomes(trials)
+
+        # At least one batch per worker, so a refill keeps every worker busy
+        numOfBatches = max(-(-trials // parallel_batch_size), self.workers)
+        tasks = [(self.block.name, self.shape, self.varyingDelays,
+                  np.random.SeedSequence(self.seed.entropy, spawn_key=(self.planIndex, self.batchIndex + batch)),
+                  parallel_batch_size)
+                 for batch in range(numOfBatches)]
+        self.batchIndex += numOfBatches
+        return np.concatenate(self.pool.starmap(shared_plan_trials, tasks, chunksize=1))
+
+    def release(self):
+        if self.block is not None:
+            self.block.close()
+            self.block.unlink()
+            self.block = None
+
+    def close(self):
+        self.release()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+# The SimulationCore of the plan a pool worker ran last, by shared memory name
+worker_core = (None, None)
+
+
+def shared_plan_trials(name, shape, varyingDelays, seed, trials):
+    # Pool task: runs a batch of trials on the plan in shared memory, copied out once per plan and worker
+    global worker_core
+    if worker_core[0] != name:
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            numOfAgents, pathLength = shape
+            paths = np.ndarray(shape, np.int64, block.buf).copy()
+            lastIndex = np.ndarray(numOfAgents, np.int64, block.buf, paths.nbytes).copy()
+            moveProb = np.ndarray(numOfAgents, np.float64, block.buf, paths.nbytes + lastIndex.nbytes).copy()
+        finally:
+            block.close()
+        worker_core = (name, SimulationCore(None, varyingDelays, None, arrays=(paths, lastIndex, moveProb)))
+
+    core = worker_core[1]
+    core.rng = np.random.default_rng(seed)
+    return core.outcomes(trials)
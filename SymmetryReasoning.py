@@ -0,0 +1,95 @@
+import math
+from collections import deque
+
+from MapLoader import blocked_cells
+
+
+########################################################## Corridor Reasoning Class #####################################################3
+
+class CorridorReasoning:
+    # A corridor is a maximal chain c0..ck of cells with exactly two free neighbors. Two agents crossing it in
+    # opposite directions cannot be inside it at the same time, so one of them has to wait for the other. If a
+    # can only reach ck through the corridor before time Ba, and b can only reach c0 through it before time Bb,
+    # every conflict-free plan keeps a out of ck during [1, Ba] or b out of c0 during [1, Bb] (with Ba, Bb below).
+    # Only valid when the plan must be conflict free (no delays) and no start or goal of either agent is inside.
+    def __init__(self, MapAndDims, AgentLocations):
+        self.cols = MapAndDims["Cols"]
+        self.maxCells = MapAndDims["Cols"] * MapAndDims["Rows"]
+        self.blockedCells = blocked_cells(MapAndDims)
+        self.AgentLocations = AgentLocations
+        self.corridors = {}
+        self.distances = {}
+
+    def neighbors(self, loc):
+        col = loc % self.cols
+        for loc_after_move, allowed in ((loc + 1, col != self.cols - 1), (loc - 1, col != 0),
+                                        (loc + self.cols, True), (loc - self.cols, True)):
+            if allowed and 0 <= loc_after_move < self.maxCells and self.blockedCells[loc_after_move] == 0:
+                yield loc_after_move
+
+    def degree(self, loc):
+        return sum(1 for _ in self.neighbors(loc))
+
+    def corridor(self, loc):
+        if loc in self.corridors:
+            return self.corridors[loc]
+
+        chain = None
+        if self.degree(loc) == 2:
+            chain = [loc]
+            for direction, start in enumerate(self.neighbors(loc)):
+                cells, prev, curr = [], loc, start
+                while curr != loc and self.degree(curr) == 2:
+                    cells.append(curr)
+                    prev, curr = curr, next(n for n in self.neighbors(curr) if n != prev)
+                if curr == loc:
+                    # A closed loop of corridor cells has no ends to reason about
+                    chain = None
+                    break
+                chain = cells[::-1] + chain if direction == 0 else chain + cells
+
+        self.corridors[loc] = chain
+        return chain
+
+    def distance(self, source, target, avoid=frozenset()):
+        key = (source, avoid)
+        if key not in self.distances:
+            dist = {source: 0}
+            queue = deque([source])
+            while queue:
+                loc = queue.popleft()
+                for loc_after_move in self.neighbors(loc):
+                    if loc_after_move not in dist and loc_after_move not in avoid:
+                        dist[loc_after_move] = dist[loc] + 1
+                        queue.append(loc_after_move)
+            self.distances[key] = dist
+        return self.distances[key].get(target, math.inf)
+
+    def corridorConstraints(self, N, x, agent1, agent2):
+        # Returns ((agent, loc, lastTime), (agent, loc, lastTime)) for the two children, or None
+        cells = sorted(x) if isinstance(x, frozenset) else [x]
+        chain = next((chain for chain in map(self.corridor, cells) if chain is not None), None)
+        if chain is None or len(chain) < 2:
+            return None
+
+        inside = set(chain)
+        for agent in (agent1, agent2):
+            if inside & set(N.sequence["Allocations"][agent]) or self.AgentLocations[agent] in inside:
+                return None
+
+        k = len(chain) - 1
+        for a, b in ((agent1, agent2), (agent2, agent1)):
+            # a crosses from chain[0] to chain[-1], b the other way
+            startA, startB = self.AgentLocations[a], self.AgentLocations[b]
+            exitA, exitB = chain[-1], chain[0]
+            lastTimeA = min(self.distance(startA, exitA, frozenset(inside - {exitA})) - 1,
+                            self.distance(startB, exitB) + k)
+            lastTimeB = min(self.distance(startB, exitB, frozenset(inside - {exitB})) - 1,
+                            self.distance(startA, exitA) + k)
+
+            # Both children must rule out the current paths, otherwise the split would not make progress
+            if (exitA in N.paths[a]["path"][1:lastTimeA + 1] and
+                    exitB in N.paths[b]["path"][1:lastTimeB + 1]):
+                return (a, exitA, lastTimeA), (b, exitB, lastTimeB)
+
+        return None
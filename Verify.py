@@ -1,8 +1,20 @@
 import math
 import random
 from itertools import combinations
+
+import numpy as np
 from scipy.stats import norm
 
+from DelayModel import delay_model
+from SimulationCore import ParallelTrials, SimulationCore, importance_nominal_share
+
+# Trials the vectorized simulations run ahead of the sequential test, which takes their outcomes one at a time
+vectorized_batch = 32
+# Importance sampling: trials of the first batch (each later batch doubles the total), and the collisions below which
+# the normal bound on the weighted estimate is not trusted
+importance_first_batch = 100
+importance_min_failures = 10
+
 
 def verifyWithoutDelay(paths):
     for agent1, agent2 in combinations(paths.keys(), 2):
@@ -47,8 +59,12 @@ def verifyWithoutDelay(paths):
 
 class Verify:
 
-    def __init__(self, delaysProb, safe_prob, verifyAlpha, process_queue, findConflictALg, typeOfVerify):
-        self.delaysProb = delaysProb
+    def __init__(self, delaysProb, safe_prob, verifyAlpha, process_queue, findConflictALg, typeOfVerify,
+                 vectorized=False, workers=0, importance=False):
+        self.delaysProb = delay_model(delaysProb)
+        # Delay probability of every agent for the trials run one agent at a time, which only serve models that
+        # depend on the agent alone
+        self.agentDelays = self.delaysProb.agentDelays
         self.desired_safe_prob = safe_prob
         self.verifyAlpha = verifyAlpha
         self.randGen = random.Random(47)
@@ -56,16 +72,34 @@ class Verify:
         self.curr_sol = [None, None, -math.inf]
         self.process_queue = process_queue
         self.typeOfVerify = typeOfVerify
+        self.simulations = 0
+        # Vectorized trials (SimulationCore) draw from a numpy generator, so their random stream differs from randGen.
+        # Delay models that vary by cell or timestep draw the move probabilities in bulk, so they always use them
+        vectorized = vectorized or self.delaysProb.varying
+        self.rng = np.random.default_rng(47) if vectorized or workers > 1 or importance else None
+        # Importance sampling runs its trials in this process, whatever the number of workers
+        self.importance = importance
+        # With more than one worker, vectorized trials run on a process pool (ParallelTrials), started on first use
+        self.workers = workers
+        self.parallelTrials = None
+        self.closed = False
+        self.simulationCore = None
+        self.pendingOutcomes = []
 
     ############################################### Verify ####################################################
     def verify(self, N):
-        if self.delaysProb[0] == 0:
+        if not self.delaysProb.anyDelays:
             return verifyWithoutDelay(N.paths)
 
+        # The paths of a node may have changed since it was last verified (bypass)
+        self.simulationCore = None
+
         # Check if 1-Robust
         if not self.findConflictALg.Check_Potential_Conflict_in_first_step(N):
             return False
 
+        if self.importance:
+            return self.importance_verify(N)
         if self.typeOfVerify == "Strict":
             return self.strict_verify(N)
         else:
@@ -81,7 +115,7 @@ class Verify:
             c1, c2 = self.compute_confidence_bounds(self.desired_safe_prob, s0)
 
             if P0 >= c1:
-                self.process_queue.put([dict(N.paths), N.g, self.desired_safe_prob])
+                self.process_queue.put([dict(N.paths), N.g, self.desired_safe_prob, N.bound])
                 return True
 
             if P0 < c2:
@@ -121,7 +155,7 @@ class Verify:
             p_c1, p_c2 = self.compute_safe_prob_bounds(P0, s0)
 
             if p_c1 > self.curr_sol[2]:
-                self.curr_sol = [dict(N.paths), N.g, p_c1]
+                self.curr_sol = [dict(N.paths), N.g, p_c1, N.bound]
                 self.process_queue.put(self.curr_sol)
 
                 if p_c1 >= self.desired_safe_prob:
@@ -133,9 +167,63 @@ class Verify:
             count_success += self.run_s_simulations(1, N.paths)
             s0 += 1
 
+    ############################################### Importance Sampling Verify ####################################################
+    def importance_verify(self, N):
+        # Bounds the collision probability with a weighted estimate from trials that delay conflict-prone agents
+        # more (SimulationCore.weightedOutcomes), which sees the rare collisions of plans near a high safe_prob
+        # in far fewer trials. Strict and Anytime make the same decisions as on the plain estimate
+        simulationCore = SimulationCore(N.paths, self.delaysProb, self.rng)
+        z = norm.ppf(1 - self.verifyAlpha)
+        s0, failures, failureSum, failureSquares = 0, 0, 0.0, 0.0
+        batch = importance_first_batch
+
+        while True:
+            success, weights = simulationCore.weightedOutcomes(batch)
+            self.simulations += batch
+            failed = weights[~success]
+            s0 += batch
+            failures += len(failed)
+            failureSum += failed.sum()
+            failureSquares += (failed ** 2).sum()
+
+            estimate = failureSum / s0
+            margin = z * math.sqrt(max(failureSquares / s0 - estimate ** 2, 0) / s0)
+            # With few collisions the sample variance is unreliable; the upper bound falls back to the largest
+            # weight times the bound on the collision rate of the trials, and no plan is rejected
+            if failures < importance_min_failures:
+                p_c1 = 1 - estimate - margin - z ** 2 / (importance_nominal_share * s0)
+                p_c2 = 1
+                # Trials after which this bound alone would pass, so the doubling does not overshoot it
+                needed = math.ceil(z ** 2 / (importance_nominal_share * max(1 - self.desired_safe_prob - estimate, 1e-12)))
+            else:
+                p_c1 = 1 - estimate - margin
+                p_c2 = 1 - max(estimate - margin, 0)
+                needed = 2 * s0
+            p_c1 = max(p_c1, 0)
+
+            if self.typeOfVerify == "Strict":
+                if p_c1 >= self.desired_safe_prob:
+                    self.process_queue.put([dict(N.paths), N.g, self.desired_safe_prob, N.bound])
+                    return True
+            elif p_c1 > self.curr_sol[2]:
+                self.curr_sol = [dict(N.paths), N.g, p_c1, N.bound]
+                self.process_queue.put(self.curr_sol)
+
+                if p_c1 >= self.desired_safe_prob:
+                    return True
+
+            if p_c2 < self.desired_safe_prob:
+                return False
+
+            batch = max(min(s0, needed - s0), importance_first_batch)
+
     ############################################### Run Simulation ####################################################
     def run_s_simulations(self, s0, paths):
+        if self.rng is not None:
+            return self.run_vectorized_simulations(s0, paths)
+
         count_success = 0
+        self.simulations += s0
 
         # Run s0 simulations
         for sim in range(s0):
@@ -161,7 +249,7 @@ class Verify:
                     lastLoc = info_path["path"][0]
 
                     # Simulate agent movement with a delay probability
-                    if len(info_path["path"]) != 1 and self.randGen.random() > self.delaysProb[agent]:
+                    if len(info_path["path"]) != 1 and self.randGen.random() > self.agentDelays[agent]:
                         # Remove the first step if the agent moves
                         info_path["path"].pop(0)
 
@@ -191,3 +279,33 @@ class Verify:
 
         # Return the number of successful simulations
         return count_success
+
+    def run_vectorized_simulations(self, s0, paths):
+        if self.simulationCore is None or self.simulationCore.plan is not paths:
+            self.simulationCore = self.trialSource(paths)
+            self.pendingOutcomes = []
+
+        # The sequential tests ask for one more trial at a time; a batch is run ahead and handed out in order
+        if len(self.pendingOutcomes) < s0:
+            outcomes = self.simulationCore.outcomes(max(s0 - len(self.pendingOutcomes), vectorized_batch))
+            # The pool may run more trials than asked for, in whole batches
+            self.simulations += len(outcomes)
+            self.pendingOutcomes.extend(outcomes.tolist())
+        outcomes, self.pendingOutcomes = self.pendingOutcomes[:s0], self.pendingOutcomes[s0:]
+        return sum(outcomes)
+
+    def trialSource(self, paths):
+        # After close() (possibly from the thread that releases a planner about to be terminated) no new pool starts
+        if self.workers <= 1 or self.closed:
+            return SimulationCore(paths, self.delaysProb, self.rng)
+
+        if self.parallelTrials is None:
+            self.parallelTrials = ParallelTrials(self.workers, 47)
+        self.parallelTrials.setPlan(paths, self.delaysProb)
+        return self.parallelTrials
+
+    def close(self):
+        self.closed = True
+        if self.parallelTrials is not None:
+            self.parallelTrials.close()
+            self.parallelTrials = None
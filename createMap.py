@@ -1,9 +1,14 @@
 import os
 import random
+import sys
+import numpy as np
+
+from InstanceStore import convert_text_instances, write_instance_store
+from MapLoader import load_map
 
 
 def create_locations_for_agents_And_Goals(NumAgents, NumGoals, MapAndDim):
-    zero_indices = [i for i, value in enumerate(MapAndDim["Map"]) if value == 0]
+    zero_indices = np.flatnonzero(np.asarray(MapAndDim["Map"]) == 0).tolist()
     chosen_indices_for_agents = random.sample(zero_indices, NumAgents)
     position_for_agents = [num for num in chosen_indices_for_agents]
 
@@ -14,32 +19,30 @@ def create_locations_for_agents_And_Goals(NumAgents, NumGoals, MapAndDim):
     return position_for_agents, location_for_agents
 
 
-def read_map_file(file_path):
-    with open("OurResearch.domain/" + file_path, 'r') as f:
-        lines = f.readlines()
-
-    map_start_index = lines.index("map\n") + 1
-    map_lines = lines[map_start_index:]
-
-    currMap = []
-    rows, cols = 0, 0
-    for line in map_lines:
-        cols = len(line.strip())
-        rows += 1
-        for char in line.strip():
-            currMap += [0] if char == "." else [1]
-    print(rows, cols)
-    return {"Rows": rows, "Cols": cols, "Map": currMap}
-
-
 mapsList = ["random-32-32-20.map", "maze-32-32-2.map", "room-32-32-4.map", "warehouse-10-20-10-2-1.map"]
 output_dir = "Agent_Goal_locations_files"
 os.makedirs(output_dir, exist_ok=True)
 
+# "--format text" (default) writes one pair of text files per instance, "--format store" writes a single
+# binary instance store per map, "--format both" writes both. "--from-text" only converts existing text files.
+output_format = sys.argv[sys.argv.index("--format") + 1] if "--format" in sys.argv else "text"
+
+if "--from-text" in sys.argv:
+    for map_name in mapsList:
+        print(map_name, convert_text_instances(map_name))
+    sys.exit(0)
+
 for map_name in mapsList:
-    mapAndDim = read_map_file(map_name)
+    mapAndDim = load_map(map_name)
+    print(mapAndDim["Rows"], mapAndDim["Cols"])
+    agents_per_instance, goals_per_instance = [], []
     for instance in range(300):
         AgentsPositions, GoalsLocations = create_locations_for_agents_And_Goals(70, 130, mapAndDim)
+        agents_per_instance.append(AgentsPositions)
+        goals_per_instance.append(GoalsLocations)
+
+        if output_format == "store":
+            continue
 
         agents_file = os.path.join(output_dir,
                                    f"{map_name.split('.')[0]}_Map_Agent_Locs_instance_{instance}.txt")
@@ -52,4 +55,7 @@ for map_name in mapsList:
 
         with open(goals_file, "w") as f:
             for item in GoalsLocations:
-                f.write(f"{item}\n")
\ No newline at end of file
+                f.write(f"{item}\n")
+
+    if output_format in ("store", "both"):
+        write_instance_store(map_name, agents_per_instance, goals_per_instance)
@@ -1,18 +1,22 @@
 import math
-from collections import defaultdict, deque
-import numpy as np
 import gurobipy as gp
 from gurobipy import GRB
+from MapLoader import precompute_costs
 
 class kBestSequencingByMakespan:
 
-    def __init__(self, AgentLocations, GoalLocations, dict_of_map_and_dim, gurobiModel):
+    def __init__(self, AgentLocations, GoalLocations, dict_of_map_and_dim, gurobiModel, agentCapacities=None,
+                 goalWindows=None):
         self.num_agents, self.num_goals = len(AgentLocations), len(GoalLocations)
         self.nodes_dict = {"All": AgentLocations + GoalLocations, "Total": self.num_agents + self.num_goals}
         self.goal_indices = list(range(self.num_agents, self.nodes_dict["Total"]))
 
         self.MapAndDims = dict_of_map_and_dim
-        self.cost_dict = self.precompute_costs(GoalLocations)
+        self.cost_dict = precompute_costs(dict_of_map_and_dim, GoalLocations)
+
+        # Optional limits: the most goals each agent may serve, and a (release, deadline) per goal location
+        self.agentCapacities = agentCapacities or {}
+        self.windows = {j: tuple((goalWindows or {}).get(self.nodes_dict["All"][j], (0, None))) for j in self.goal_indices}
 
         # Create the MILP model with a minimization objective
         self.model = gurobiModel
@@ -27,6 +31,7 @@ class kBestSequencingByMakespan:
 
         # Flow variables for cycle elimination among goals: f[i,j] is flow on arc (i,j), it must be 0 if x[i,j]=0
         self.f = self.model.addVars(list(self.x.keys()), vtype=GRB.INTEGER, lb=0, ub=self.num_goals, name="f")
+        self.add_capacity_and_window_bounds()
 
         self.T = self.model.addVar(vtype=GRB.INTEGER, lb=0, name="T")
 
@@ -51,14 +56,18 @@ class kBestSequencingByMakespan:
             for j in self.goal_indices:
                 if i != j:
                     cost = self.cost_dict.get((self.nodes_dict["All"][i], self.nodes_dict["All"][j]))
+                    # A goal with a release time may be reached early and waited at, so only its lower bound is tight
+                    waits = self.windows[j][0] > 0
                     if i < self.num_agents:
                         # If coming directly from an agent to a goal
                         self.model.addConstr(self.t[j] >= cost - (1 - self.x[i, j]) * M)
-                        self.model.addConstr(self.t[j] <= cost + (1 - self.x[i, j]) * M)
+                        if not waits:
+                            self.model.addConstr(self.t[j] <= cost + (1 - self.x[i, j]) * M)
                     else:
                         # If coming from a previous goal to the current goal
                         self.model.addConstr(self.t[j] >= self.t[i] + cost - (1 - self.x[i, j]) * M)
-                        self.model.addConstr(self.t[j] <= self.t[i] + cost + (1 - self.x[i, j]) * M)
+                        if not waits:
+                            self.model.addConstr(self.t[j] <= self.t[i] + cost + (1 - self.x[i, j]) * M)
 
         # Constraint 5: flow allowed only on selected arcs
         for (i, j) in self.x.keys():
@@ -77,6 +86,38 @@ class kBestSequencingByMakespan:
         for j in self.goal_indices:
             self.model.addConstr(self.T >= self.t[j])
 
+    def add_capacity_and_window_bounds(self):
+        # Flow on an agent's first arc is the number of goals it serves, so a capacity is an upper bound on it;
+        # flow on a goal-to-goal arc counts the goals after it, at most the largest capacity minus one
+        if self.agentCapacities:
+            max_capacity = max(self.agentCapacities.get(a, self.num_goals) for a in range(self.num_agents))
+            for (i, j) in self.f.keys():
+                if i < self.num_agents:
+                    self.f[i, j].ub = min(self.num_goals, self.agentCapacities.get(i, self.num_goals))
+                else:
+                    self.f[i, j].ub = min(self.num_goals, max(max_capacity - 1, 0))
+
+        if not any(window != (0, None) for window in self.windows.values()):
+            return
+
+        # Service times start no earlier than the release and the nearest agent, and end by the deadline
+        earliest = {}
+        for j in self.goal_indices:
+            release, deadline = self.windows[j]
+            nearest = min(self.cost_dict[(self.nodes_dict["All"][a], self.nodes_dict["All"][j])]
+                          for a in range(self.num_agents))
+            earliest[j] = max(release, nearest)
+            self.t[j].lb = earliest[j]
+            if deadline is not None:
+                self.t[j].ub = deadline
+
+        # Arcs that cannot meet the deadline of their goal are never selected
+        for (i, j) in self.x.keys():
+            deadline = self.windows[j][1]
+            cost = self.cost_dict[(self.nodes_dict["All"][i], self.nodes_dict["All"][j])]
+            if deadline is not None and earliest.get(i, 0) + cost > deadline:
+                self.x[i, j].ub = 0
+
     def __iter__(self):
         return self
 
@@ -103,56 +144,3 @@ class kBestSequencingByMakespan:
         # Add exclusion constraint to prevent repeating this edge set
         self.model.addConstr(gp.quicksum(self.x[i, j] for (i, j) in current_edges) <= len(current_edges) - 1)
         return {"Allocations": paths, "Cost": int(round(self.T.X))}
-
-    def precompute_costs(self, GoalLocations):
-        precomputed_cost = defaultdict(lambda: 1000000)
-        for goal in GoalLocations:
-            self.BFS(goal, precomputed_cost)
-        return precomputed_cost
-
-    def BFS(self, goal, precomputed_cost):
-        visited = np.zeros(self.MapAndDims["Cols"] * self.MapAndDims["Rows"], dtype=bool)
-        queue = deque([(goal, 0)])
-
-        while queue:
-            current_loc, cost = queue.popleft()
-
-            if visited[current_loc]:
-                continue
-            visited[current_loc] = True
-
-            precomputed_cost[(current_loc, goal)] = cost
-
-            for neighbor_loc, new_cost in self.get_neighbors(current_loc, cost):
-                if not visited[neighbor_loc]:
-                    queue.append((neighbor_loc, new_cost))
-
-    def get_neighbors(self, current_loc, cost):
-        neighbors = []
-        for neighborLoc in [current_loc + 1, current_loc + self.MapAndDims["Cols"],
-                            current_loc - 1, current_loc - self.MapAndDims["Cols"]]:
-            if self.validate_move(neighborLoc, current_loc):
-                neighbors.append((neighborLoc, cost + 1))
-        return neighbors
-
-    def validate_move(self, loc_after_move, loc):
-        # Extract the agent's location and direction before taking the next step
-
-        # If the agent is at the top or bottom boundary, it cannot move up or down
-        if not (0 <= loc_after_move < self.MapAndDims["Cols"] * self.MapAndDims["Rows"]):
-            return False
-
-        # If the agent is at the right boundary, it cannot move right
-        if loc % self.MapAndDims["Cols"] == self.MapAndDims["Cols"] - 1 and loc_after_move % \
-                self.MapAndDims["Cols"] == 0:
-            return False
-
-        # If the agent is at the left boundary, it cannot move left
-        if loc % self.MapAndDims["Cols"] == 0 and loc_after_move % self.MapAndDims["Cols"] == \
-                self.MapAndDims["Cols"] - 1:
-            return False
-
-        if self.MapAndDims["Map"][loc_after_move] != 0:
-            return False
-
-        return True
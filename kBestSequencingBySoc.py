@@ -1,19 +1,20 @@
 import math
-from collections import defaultdict, deque
-import numpy as np
 import gurobipy as gp
 from gurobipy import GRB
+from MapLoader import precompute_costs
 
 
 class kBestSequencingBySoc:
 
-    def __init__(self, AgentLocations, GoalLocations, dict_of_map_and_dim, gurobiModel):
+    def __init__(self, AgentLocations, GoalLocations, dict_of_map_and_dim, gurobiModel, agentCapacities=None):
         self.num_agents, self.num_goals = len(AgentLocations), len(GoalLocations)
         self.nodes_dict = {"All": AgentLocations + GoalLocations, "Total": self.num_agents + self.num_goals}
         self.goal_indices = list(range(self.num_agents, self.nodes_dict["Total"]))
 
         self.MapAndDims = dict_of_map_and_dim
-        self.cost_dict = self.precompute_costs(GoalLocations)
+        self.cost_dict = precompute_costs(dict_of_map_and_dim, GoalLocations)
+        # Optional limit on the most goals each agent may serve
+        self.agentCapacities = agentCapacities or {}
 
         # Create the MILP model with a minimization objective
         self.model = gurobiModel
@@ -25,6 +26,7 @@ class kBestSequencingBySoc:
 
         # Flow variables for cycle elimination among goals: f[i,j] is flow on arc (i,j), it must be 0 if x[i,j]=0
         self.f = self.model.addVars(list(self.x.keys()), vtype=GRB.INTEGER, lb=0, ub=self.num_goals, name="f")
+        self.add_capacity_bounds()
 
         self.model.setObjective(
             gp.quicksum(self.cost_dict[(self.nodes_dict["All"][i], self.nodes_dict["All"][j])] * self.x[i, j]
@@ -56,6 +58,18 @@ class kBestSequencingBySoc:
         self.model.addConstr(gp.quicksum(self.f[a, j] for a in range(self.num_agents) for j in self.goal_indices if
                                          (a, j) in self.f) == self.num_goals)
 
+    def add_capacity_bounds(self):
+        # Flow on an agent's first arc is the number of goals it serves, so a capacity is an upper bound on it;
+        # flow on a goal-to-goal arc counts the goals after it, at most the largest capacity minus one
+        if not self.agentCapacities:
+            return
+        max_capacity = max(self.agentCapacities.get(a, self.num_goals) for a in range(self.num_agents))
+        for (i, j) in self.f.keys():
+            if i < self.num_agents:
+                self.f[i, j].ub = min(self.num_goals, self.agentCapacities.get(i, self.num_goals))
+            else:
+                self.f[i, j].ub = min(self.num_goals, max(max_capacity - 1, 0))
+
     def __iter__(self):
         return self
 
@@ -85,56 +99,3 @@ class kBestSequencingBySoc:
         # Add exclusion constraint to prevent repeating this edge set
         self.model.addConstr(gp.quicksum(self.x[i, j] for (i, j) in current_edges) <= len(current_edges) - 1)
         return {"Allocations": paths, "Cost": soc}
-
-    def precompute_costs(self, GoalLocations):
-        precomputed_cost = defaultdict(lambda: 1000000)
-        for goal in GoalLocations:
-            self.BFS(goal, precomputed_cost)
-        return precomputed_cost
-
-    def BFS(self, goal, precomputed_cost):
-        visited = np.zeros(self.MapAndDims["Cols"] * self.MapAndDims["Rows"], dtype=bool)
-        queue = deque([(goal, 0)])
-
-        while queue:
-            current_loc, cost = queue.popleft()
-
-            if visited[current_loc]:
-                continue
-            visited[current_loc] = True
-
-            precomputed_cost[(current_loc, goal)] = cost
-
-            for neighbor_loc, new_cost in self.get_neighbors(current_loc, cost):
-                if not visited[neighbor_loc]:
-                    queue.append((neighbor_loc, new_cost))
-
-    def get_neighbors(self, current_loc, cost):
-        neighbors = []
-        for neighborLoc in [current_loc + 1, current_loc + self.MapAndDims["Cols"],
-                            current_loc - 1, current_loc - self.MapAndDims["Cols"]]:
-            if self.validate_move(neighborLoc, current_loc):
-                neighbors.append((neighborLoc, cost + 1))
-        return neighbors
-
-    def validate_move(self, loc_after_move, loc):
-        # Extract the agent's location and direction before taking the next step
-
-        # If the agent is at the top or bottom boundary, it cannot move up or down
-        if not (0 <= loc_after_move < self.MapAndDims["Cols"] * self.MapAndDims["Rows"]):
-            return False
-
-        # If the agent is at the right boundary, it cannot move right
-        if loc % self.MapAndDims["Cols"] == self.MapAndDims["Cols"] - 1 and loc_after_move % \
-                self.MapAndDims["Cols"] == 0:
-            return False
-
-        # If the agent is at the left boundary, it cannot move left
-        if loc % self.MapAndDims["Cols"] == 0 and loc_after_move % self.MapAndDims["Cols"] == \
-                self.MapAndDims["Cols"] - 1:
-            return False
-
-        if self.MapAndDims["Map"][loc_after_move] != 0:
-            return False
-
-        return True